@@ -1,39 +1,165 @@
+import asyncio
+import copy
+import functools
+import bisect
 import datetime
+import gzip
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
+import multiprocessing
 import os
 import sys
 import tempfile
 import time
 import re
+import shutil
+import signal
+import sqlite3
 import traceback
 import uuid
-from threading import Timer
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http import HTTPStatus
+from threading import Thread, Lock
 from os.path import isfile
-from typing import Dict, Any, List, Tuple
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Iterable
 
+import numpy as np
+import openpyxl
 import pandas as pd
 import pytz
 import telegram.helpers
+import tornado.httpserver
+import tornado.web
 from yaml import safe_load as yaml_safe_load
 from yaml import safe_dump as yaml_safe_dump
+from yaml import SafeDumper
 import logging
 from telegram import Update, Bot, ReplyKeyboardMarkup, KeyboardButton, PhotoSize, Animation, \
     Video, Location, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, Forbidden, TelegramError
+from telegram.request import BaseRequest
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, ChatMemberHandler, \
+    ContextTypes, BaseUpdateProcessor, filters
 from better_profanity import profanity
 from cleantext import clean
 
+# sets are stored in context as sorted lists
+SafeDumper.add_representer(set, lambda dumper, data: dumper.represent_list(sorted(data)))
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
 CONTEXT: dict
-IS_CONTEXT_CHANGED = False
+STORAGE: 'YamlContextStorage' or 'SqliteContextStorage'
+# context, its journal, database and requests log, paths are set by init_data_directory
+DATA_DIRECTORY = '.'
+CONTEXT_FILENAME = 'context.yaml'
+CONTEXT_JOURNAL_FILENAME = 'context.journal'
+CONTEXT_JOURNAL_COMPACTION_SIZE = 4 * 1024 * 1024
+CONTEXT_SAVE_LOCK = Lock()
+CONTEXT_COMPACTION_THREAD: Thread or None = None
+DIRTY_CONTEXT_ENTRIES = set()
+UNSAVED_CONTEXT_ENTRIES = Counter()
 CONFIG: dict
 BOT: Bot
-RECENT_REQUESTS = []
+RECENT_REQUESTS_EXPIRATION: List[Tuple[int, Any]] = []
 RECENT_REQUESTS_TIMER_MINS = 5
+# request hash -> message id future of the request being published, until it is registered as recent
+RECENT_REQUESTS_PENDING: Dict[str, asyncio.Future] = {}
+BAN_CACHE: Dict[int, Tuple[bool, float]] = {}
+BAN_CACHE_MAX_SIZE = 50000
+BAN_CACHE_REFRESHING = set()
+BACKGROUND_TASKS = set()
+METRICS: Dict[str, float] = {}
+OUTBOUND: 'OutboundDispatcher'
+# lower value is sent first
+SEND_PRIORITY_MAIN_GROUP = 0
+SEND_PRIORITY_USER = 1
+SEND_PRIORITY_NOTIFICATION = 2
+SEND_PRIORITY_ERROR_REPORT = 3
+SEND_PRIORITIES_NAMES = {
+    SEND_PRIORITY_MAIN_GROUP: 'main_group',
+    SEND_PRIORITY_USER: 'user',
+    SEND_PRIORITY_NOTIFICATION: 'notification',
+    SEND_PRIORITY_ERROR_REPORT: 'error_report'
+}
+SEND_RETRIES = 3
+SAVE_CONTEXT_INTERVAL_SECS = 10
+LOOP_LAG_CHECK_INTERVAL_SECS = 0.5
+# single thread keeps file writes ordered
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='io')
+CPU_EXECUTOR: ProcessPoolExecutor or None = None
+REQUESTS_LOG: 'RequestsLogWriter'
+REQUESTS_MIGRATION_BATCH_RECORDS = 20000
+REQUESTS_FILTER_FIELDS = ['category', 'house', 'street', 'user', 'problem_area']
+REQUESTS_STATS_FIELDS = ['category', 'house', 'section']
+# day -> (hour, category, house, section) -> count of requests_stats context section, so /stats reads only its days
+REQUESTS_STATS_BY_DAY: Dict[str, Counter] = {}
+# sorted days of REQUESTS_STATS_BY_DAY
+REQUESTS_STATS_DAYS: List[str] = []
+REQUESTS_CACHE_CATEGORICAL_COLUMNS = ['category', 'problem_area', 'street', 'house', 'media_type']
+REQUESTS_CACHE_NUMERIC_COLUMNS = ['section', 'floor', 'flat', 'parking', 'storeroom', 'media_message']
+REQUESTS_CACHE_TEXT_COLUMNS = ['address', 'details', 'geo']
+REQUESTS_INDEX_REORDER_MARGIN_MS = 60 * 1000
+REQUESTS_INDEX_SAVE_THRESHOLD = 1000
+REQUESTS_SPARSE_INDEX_STEP = 64
+REQUESTS_EXPORT_COLUMNS = ['date', 'category', 'problem_area', 'address', 'street', 'house', 'section',
+                           'floor', 'flat', 'parking', 'storeroom', 'user', 'details', 'media_message',
+                           'media_type', 'geo']
+CLEANUP_RECENT_REQUESTS_INTERVAL_SECS = 30
+# confirmed requests are kept in outbox context section until all publication steps are done
+OUTBOX_IN_PROGRESS = set()
+OUTBOX_RESUME_INTERVAL_SECS = 30
+OUTBOX_MAX_RESUME_INTERVAL_SECS = 3600
+# request still failing after so many resumes is moved to outbox_parked section and superusers are notified
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_ATTACHMENTS_TYPES = {'photo': PhotoSize, 'gif': Animation, 'video': Video}
+# static keyboards built on config load
+KEYBOARDS: Dict[str, ReplyKeyboardMarkup or ReplyKeyboardRemove] = {}
+# state -> coroutine validating user message and moving to the next state
+DIALOG_HANDLERS: Dict[str, Any] = {}
+# state -> coroutine asking user for the state input
+DIALOG_PROMPTS: Dict[str, Any] = {}
+# number states -> user context key, min and max values
+NUMBER_DIALOG_STATES = {
+    'select_section_number': ('selected_section', 1, 19),
+    'select_floor_number': ('selected_floor', -1, 30),
+    'select_flat_number': ('selected_flat', 1, 2000),
+    'select_parking_number': ('selected_parking', 1, 1000),
+    'select_storeroom_number': ('selected_storeroom', 1, 1000)
+}
+# street -> house -> floors count of each section, only enabled buildings of streets config
+ADDRESS_INDEX: Dict[str, Dict[str, Tuple[int, ...]]] = {}
+# (street,), (street, house) and (street, house, section) -> keyboard with its houses, sections or floors
+ADDRESS_KEYBOARDS: Dict[Tuple, ReplyKeyboardMarkup] = {}
+ADDRESS_KEYBOARD_ROW_SIZE = 6
+# address prompts -> user context keys of the address keyboard
+ADDRESS_PROMPTS_CONTEXT_KEYS = {
+    'select_house_number': ['selected_street'],
+    'select_section_number': ['selected_street', 'selected_house'],
+    'select_floor_number': ['selected_street', 'selected_house', 'selected_section']
+}
+CATEGORIES_FLAGS: Dict[str, Dict[str, bool]] = {}
+CATEGORIES_ROUTES: Dict[str, List[str]] = {}
+PROBLEM_AREAS_ROUTES: Dict[str, List[str]] = {}
+LOCATION_PROBLEM_AREA = 'место на карте'
+# keyphrases groups in priority order, all of them are matched by single regex
+KEYPHRASES_INTENTS = ['go_back', 'go_restart', 'go_confirm']
+KEYPHRASES_INTENTS_BY_PHRASE: Dict[str, str] = {}
+KEYPHRASES_REGEX: re.Pattern
+BAD_WORDS_REGEX: re.Pattern
+BAD_WORDS_PREFIXES_REGEX: re.Pattern
+BAD_WORDS_WORD_REGEX: re.Pattern
+DESCRIPTION_SPECIAL_CHARS_REGEX = re.compile(r"[^a-zA-Zа-яА-Я0-9 ,.:;\-()!?\"]")
+DESCRIPTION_URLS_REGEX = re.compile(r"[0-9a-zA-Z\-]*(\.com|\.ru|\.org|\.su|\.net|\.рф|\.cc|\.ly|\.at|\.io)")
 
 COPYRIGHT_DISCLAIMER = "Copyright © 2023-2024 Федотов Леонид @iLeonidze" \
                        "\n\n" \
@@ -65,17 +191,286 @@ def encode_markdown(string: str) -> str:
     return telegram.helpers.escape_markdown(string, version=2)
 
 
-def set_interval(func, sec):
-    def func_wrapper():
-        set_interval(func, sec)
-        func()
-
-    t = Timer(sec, func_wrapper)
-    t.start()
-    return t
-
+def increment_metric(name: str, value: float = 1) -> None:
+    METRICS[name] = METRICS.get(name, 0) + value
+
+
+def run_in_background(coroutine) -> None:
+    # keep reference to the task, otherwise it could be garbage collected before completion
+    task = asyncio.get_running_loop().create_task(coroutine)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+    def try_acquire(self) -> float:
+        # takes token if available, otherwise returns seconds until it will be
+        self.refill()
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return 0
+
+    def is_idle(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class OutboundDispatcher:
+    # all bot sends go through single priority queue, so main group publication is not stuck
+    # behind notifications burst, and rate limits with flood waits are handled in one place
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.queue = asyncio.PriorityQueue()
+        self.sequence = itertools.count()
+        self.global_rate_limit = TokenBucket(global_rate, global_rate)
+        self.chats_rate_limits: Dict[int, TokenBucket] = {}
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats_paused_until: Dict[int, float] = {}
+        self.deferred = Counter()
+        # sequence number -> timer and entry, waiting for their chats flood or rate limit interval
+        self.deferred_entries: Dict[int, Tuple[asyncio.TimerHandle, Tuple]] = {}
+        self.queued = Counter()
+
+    async def send(self, priority: int, method: str, **kwargs) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self.put((priority, next(self.sequence), time.monotonic(), kwargs.get('chat_id'), method, kwargs, future, 0))
+        return await future
+
+    def put(self, entry) -> None:
+        self.queue.put_nowait(entry)
+        self.queued[entry[0]] += 1
+        self.update_depth_metrics()
+
+    def defer(self, entry, delay: float) -> None:
+        self.deferred[entry[0]] += 1
+        self.deferred_entries[entry[1]] = (asyncio.get_running_loop().call_later(delay, self.undefer, entry), entry)
+        self.update_depth_metrics()
+
+    def undefer(self, entry) -> None:
+        self.deferred[entry[0]] -= 1
+        del self.deferred_entries[entry[1]]
+        self.put(entry)
+
+    def close(self) -> None:
+        # workers are stopped, callers of deferred and queued sends should not wait forever
+        for timer, entry in self.deferred_entries.values():
+            timer.cancel()
+            entry[6].cancel()
+        self.deferred_entries.clear()
+        self.deferred.clear()
+
+        while not self.queue.empty():
+            self.queue.get_nowait()[6].cancel()
+        self.queued.clear()
+        self.update_depth_metrics()
+
+    def update_depth_metrics(self) -> None:
+        for priority, name in SEND_PRIORITIES_NAMES.items():
+            METRICS['outbound_queue_depth_' + name] = self.queued[priority] + self.deferred[priority]
+        METRICS['outbound_queue_depth'] = sum(self.queued.values()) + sum(self.deferred.values())
+        METRICS['outbound_queue_depth_max'] = max(METRICS.get('outbound_queue_depth_max', 0),
+                                                  METRICS['outbound_queue_depth'])
+
+    def get_chat_delay(self, chat_id: int) -> float:
+        now = time.monotonic()
+        paused_until = self.chats_paused_until.get(chat_id)
+        if paused_until is not None:
+            if paused_until > now:
+                return paused_until - now
+            del self.chats_paused_until[chat_id]
+
+        chat_rate_limit = self.chats_rate_limits.get(chat_id)
+        if chat_rate_limit is None:
+            # forget buckets of chats which were not used for a while
+            for idle_chat_id in [key for key, value in self.chats_rate_limits.items() if value.is_idle()]:
+                del self.chats_rate_limits[idle_chat_id]
+            chat_rate_limit = self.chats_rate_limits[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+
+        return chat_rate_limit.try_acquire()
+
+    async def run_worker(self) -> None:
+        while True:
+            entry = await self.queue.get()
+            priority, _, enqueued_at, chat_id, method, kwargs, future, attempt = entry
+            self.queued[priority] -= 1
+            self.update_depth_metrics()
+            if future.done():
+                # caller is gone, nobody waits for the result
+                continue
+
+            delay = self.get_chat_delay(chat_id)
+            if delay > 0:
+                self.defer(entry, delay)
+                continue
+
+            await self.global_rate_limit.acquire()
+            observe_metric('outbound_queue_wait', (time.monotonic() - enqueued_at) * 1000)
+            try:
+                result = await getattr(BOT, method)(**kwargs)
+            except RetryAfter as e:
+                increment_metric('send_retry_after')
+                if attempt + 1 >= SEND_RETRIES:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                # pause the whole chat, queued messages to it wait the same flood interval once
+                retry_after = get_retry_after_seconds(e)
+                self.chats_paused_until[chat_id] = max(self.chats_paused_until.get(chat_id, 0),
+                                                       time.monotonic() + retry_after)
+                self.defer(entry[:-1] + (attempt + 1,), retry_after)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+
+def init_outbound_dispatcher() -> None:
+    global OUTBOUND
+    rate_limits_config = CONFIG.get('rate_limits', {})
+    OUTBOUND = OutboundDispatcher(rate_limits_config.get('global_per_second', 30),
+                                  rate_limits_config.get('chat_per_second', 1),
+                                  rate_limits_config.get('chat_burst', 3))
+
+    for _ in range(rate_limits_config.get('send_workers', 8)):
+        run_in_background(OUTBOUND.run_worker())
+
+
+def get_retry_after_seconds(error: RetryAfter) -> float:
+    if isinstance(error.retry_after, datetime.timedelta):
+        return error.retry_after.total_seconds()
+    return error.retry_after
+
+
+def observe_metric(name: str, value_ms: float) -> None:
+    increment_metric(name + '_count')
+    increment_metric(name + '_total_ms', value_ms)
+    METRICS[name + '_max_ms'] = max(METRICS.get(name + '_max_ms', 0), value_ms)
+
+
+async def run_io(func, *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(IO_EXECUTOR, func, *args)
+
+
+async def run_cpu(func, *args) -> Any:
+    global CPU_EXECUTOR
+    if CPU_EXECUTOR is None:
+        # spawned workers do not inherit event loop and threads of the bot process
+        CPU_EXECUTOR = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    return await asyncio.get_running_loop().run_in_executor(CPU_EXECUTOR, func, *args)
+
+
+async def monitor_loop_lag() -> None:
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_CHECK_INTERVAL_SECS)
+        lag_ms = (time.monotonic() - started - LOOP_LAG_CHECK_INTERVAL_SECS) * 1000
+        observe_metric('loop_lag', lag_ms)
+
+
+def get_update_order_key(update: object) -> int or None:
+    # user context is changed by user's own updates only, so they are ordered per user
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    # updates of different users are processed concurrently, updates of the same user one by one in arrival order;
+    # user lock is taken before concurrency slot, so a flood from one user does not hold slots of others
+
+    def __init__(self, max_concurrent_updates: int):
+        # base semaphore only counts updates, the limit is applied after user lock is taken
+        super().__init__(sys.maxsize)
+        self.running_updates = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.users_locks: Dict[Any, asyncio.Lock] = {}
+        self.users_pending_updates = Counter()
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = get_update_order_key(update)
+        if key is None:
+            async with self.running_updates:
+                await coroutine
+            return
 
-async def send_request_to_main_group(update: Update, dry_run=False):
+        lock = self.users_locks.get(key)
+        if lock is None:
+            lock = self.users_locks[key] = asyncio.Lock()
+        self.users_pending_updates[key] += 1
+
+        started = time.monotonic()
+        try:
+            # asyncio lock wakes up waiters in order of their arrival
+            async with lock:
+                observe_metric('update_order_wait', (time.monotonic() - started) * 1000)
+                async with self.running_updates:
+                    await coroutine
+        finally:
+            self.users_pending_updates[key] -= 1
+            if not self.users_pending_updates[key]:
+                del self.users_pending_updates[key]
+                del self.users_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def schedule_job(application: Application, func, interval: float, name: str = None) -> None:
+    name = name or func.__name__
+
+    async def job_callback(_):
+        started = time.monotonic()
+        try:
+            result = func()
+            if asyncio.iscoroutine(result):
+                await result
+        finally:
+            observe_metric('job_' + name, (time.monotonic() - started) * 1000)
+
+    # jitter spreads jobs with the same interval, single instance protects from overlapping with an overrun
+    application.job_queue.run_repeating(job_callback,
+                                        interval=interval,
+                                        first=interval,
+                                        name=name,
+                                        job_kwargs={
+                                            'jitter': interval / 10,
+                                            'max_instances': 1,
+                                            'coalesce': True
+                                        })
+
+
+def build_request(update: Update) -> Tuple[str, Any, Any, Dict]:
     user_context = get_user_context(update)
     message_data = {
         "date": get_current_time().isoformat(),
@@ -109,7 +504,7 @@ async def send_request_to_main_group(update: Update, dry_run=False):
             update.effective_user.first_name) + '](tg://user?id=' + str(
             update.effective_user.id) + ')'
 
-    if 'пожар' in issue_type.lower():
+    if CATEGORIES_FLAGS.get(issue_type, {}).get('fire'):
         issue_area = 'в секции'
 
     issue_address = 'ул\\. ' + user_context.get('selected_street') + \
@@ -186,88 +581,313 @@ async def send_request_to_main_group(update: Update, dry_run=False):
                                duration=duration)
             message_data['media_type'] = 'video'
 
-    if user_context.get('location_latitude') and 'место' in user_context.get('selected_problem_area'):
+    if user_context.get('location_latitude') and user_context.get('selected_problem_area') == LOCATION_PROBLEM_AREA:
         location = Location(latitude=user_context.get('location_latitude'),
                             longitude=user_context.get('location_longitude'))
         message_data['geo'] = str(user_context.get('location_latitude')) + ', ' + str(user_context.get('location_longitude'))
 
-    if dry_run:
-        return message, attachment, location
+    return message, attachment, location, message_data
 
-    message_details = await BOT.send_message(text=message,
-                                             chat_id=CONFIG['groups']['main']['id'],
-                                             parse_mode='MarkdownV2')
-    message_ids = [message_details.message_id]
 
-    if location:
-        message_details = await send_location(location, CONFIG['groups']['main']['id'], message_ids[0])
-        message_ids.append(message_details.message_id)
+def build_outbox_request(update: Update) -> Dict:
+    message, attachment, location, message_data = build_request(update)
+    user_context = get_user_context(update)
+    # caption length is checked with markdown escapes, so the limit is never exceeded after parsing
+    caption = CONFIG.get('publication_mode', 'message') == 'caption' and attachment is not None \
+        and len(message) <= MessageLimit.CAPTION_LENGTH
+    return {
+        'created': get_current_timestamp(),
+        'chat_id': get_userid_from_update(update),
+        'request_hash': get_request_hash(user_context),
+        'message': message,
+        'message_data': message_data,
+        'attachment_type': user_context.get('file_type') if attachment else None,
+        'attachment': attachment.to_dict() if attachment else None,
+        'location': location.to_dict() if location else None,
+        'caption': caption,
+        # users confirmed the same request while it was waiting for publication
+        'subscribers': [],
+        'steps_message_ids': {},
+        'done_steps': [],
+        'attempts': 0,
+        'next_attempt': 0
+    }
 
-    if attachment:
-        message_details = await send_attachment(attachment, CONFIG['groups']['main']['id'], message_ids[0])
-        message_ids.append(message_details.message_id)
-        message_data['media_message'] = message_details.message_id
-
-    RECENT_REQUESTS.append({
-        'message_id': message_ids[0],
-        'sent': get_current_timestamp(),
-        'author_id': update.effective_user.id,
-        'request_hash': get_request_hash(user_context)
-    })
 
-    update_requests_history(message_ids[0], message_data)
+async def save_outbox_request(outbox_key: str, request: Dict or None) -> None:
+    if request is None:
+        CONTEXT['outbox'].pop(outbox_key, None)
+    else:
+        CONTEXT['outbox'][outbox_key] = request
+
+    # saved at once, so finished step is not repeated after restart
+    await run_io(save_context_entries, [('outbox', outbox_key, copy.deepcopy(request))])
 
-    return message_ids
 
+async def publish_request(update: Update) -> None:
+    outbox_key = get_outbox_key(update)
+    if outbox_key in OUTBOX_IN_PROGRESS:
+        return
+
+    # reserved before the first await, users confirming the same request concurrently wait for this publication
+    request_hash = get_request_hash(get_user_context(update))
+    pending_request = reserve_request_hash(request_hash)
 
-async def send_attachment(attachment, chat_id, message_id=None):
+    OUTBOX_IN_PROGRESS.add(outbox_key)
+    try:
+        if outbox_key not in CONTEXT['outbox']:
+            await save_outbox_request(outbox_key, build_outbox_request(update))
+        await process_outbox_request(outbox_key)
+    finally:
+        OUTBOX_IN_PROGRESS.discard(outbox_key)
+        release_request_hash(request_hash, pending_request)
+
+
+def get_outbox_key(update: Update) -> str:
+    # confirmation message id is the idempotency key, redelivered update does not post the request twice
+    return str(update.effective_chat.id) + ':' + str(update.effective_message.message_id)
+
+
+def reserve_request_hash(request_hash: str) -> asyncio.Future:
+    pending_request = RECENT_REQUESTS_PENDING[request_hash] = asyncio.get_running_loop().create_future()
+    return pending_request
+
+
+def release_request_hash(request_hash: str, pending_request: asyncio.Future) -> None:
+    # resolved by add_recent_request when the request is published, otherwise waiting users check the outbox
+    if RECENT_REQUESTS_PENDING.get(request_hash) is pending_request:
+        del RECENT_REQUESTS_PENDING[request_hash]
+    if not pending_request.done():
+        pending_request.set_result(None)
+
+
+def find_outbox_request(request_hash: str) -> str or None:
+    for outbox_key, request in CONTEXT['outbox'].items():
+        # published request is found among recent ones until it expires
+        if request['request_hash'] == request_hash and 'recent_request' not in request['done_steps']:
+            return outbox_key
+    return None
+
+
+async def process_outbox_request(outbox_key: str) -> None:
+    request = CONTEXT['outbox'][outbox_key]
+    steps = [
+        ('message', send_outbox_request_message),
+        ('location', send_outbox_request_location),
+        ('attachment', send_outbox_request_attachment),
+        ('recent_request', add_outbox_recent_request),
+        ('user_history', update_outbox_user_requests_history),
+        ('success_message', send_outbox_success_message),
+        ('requests_history', write_outbox_requests_history)
+    ]
+
+    if request['caption']:
+        # location does not reply to the post with caption, so they are sent in parallel
+        steps_groups = [steps[:2]] + [[step] for step in steps[2:]]
+    else:
+        steps_groups = [[step] for step in steps]
+
+    for steps_group in steps_groups:
+        steps_group = [(step, handler) for step, handler in steps_group if step not in request['done_steps']]
+        if not steps_group:
+            continue
+
+        results = await asyncio.gather(*[handler(request) for _, handler in steps_group], return_exceptions=True)
+        for (step, _), result in zip(steps_group, results):
+            if not isinstance(result, BaseException):
+                request['done_steps'].append(step)
+        await save_outbox_request(outbox_key, request)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    await save_outbox_request(outbox_key, None)
+
+
+def get_outbox_message_ids(request: Dict) -> List[int]:
+    # request post goes first, replies of responsible persons are routed by it
+    return [request['steps_message_ids'][step] for step in ['message', 'location', 'attachment']
+            if step in request['steps_message_ids']]
+
+
+async def send_outbox_request_message(request: Dict) -> None:
+    if request['caption']:
+        attachment = OUTBOX_ATTACHMENTS_TYPES[request['attachment_type']].de_json(request['attachment'], BOT)
+        message_details = await send_attachment(attachment, CONFIG['groups']['main']['id'],
+                                                priority=SEND_PRIORITY_MAIN_GROUP, caption=request['message'])
+        request['message_data']['media_message'] = message_details.message_id
+    else:
+        message_details = await OUTBOUND.send(SEND_PRIORITY_MAIN_GROUP, 'send_message',
+                                              text=request['message'],
+                                              chat_id=CONFIG['groups']['main']['id'],
+                                              parse_mode='MarkdownV2')
+    request['steps_message_ids']['message'] = message_details.message_id
+
+
+async def send_outbox_request_location(request: Dict) -> None:
+    if request['location'] is None:
+        return
+
+    message_details = await send_location(Location.de_json(request['location'], BOT), CONFIG['groups']['main']['id'],
+                                          request['steps_message_ids'].get('message'), SEND_PRIORITY_MAIN_GROUP)
+    request['steps_message_ids']['location'] = message_details.message_id
+
+
+async def send_outbox_request_attachment(request: Dict) -> None:
+    if request['attachment'] is None or request['caption']:
+        return
+
+    attachment = OUTBOX_ATTACHMENTS_TYPES[request['attachment_type']].de_json(request['attachment'], BOT)
+    message_details = await send_attachment(attachment, CONFIG['groups']['main']['id'],
+                                            request['steps_message_ids']['message'], SEND_PRIORITY_MAIN_GROUP)
+    request['steps_message_ids']['attachment'] = message_details.message_id
+    request['message_data']['media_message'] = message_details.message_id
+
+
+async def add_outbox_recent_request(request: Dict) -> None:
+    await add_recent_request(request['request_hash'], request['steps_message_ids']['message'],
+                             request['message_data']['user'],
+                             request['message_data']['category'])
+
+
+async def write_outbox_requests_history(request: Dict) -> None:
+    message_id = request['steps_message_ids']['message']
+    # record could be written before a crash which prevented this step from being saved
+    if await run_io(REQUESTS_LOG.find, message_id) is not None:
+        return
+
+    flushed = await update_requests_history(message_id, request['message_data'])
+    # step is done when group commit writes the record, it is the last step so nothing else waits for the commit,
+    # stats are counted only for the written record, failed commit is retried without counting it twice
+    await flushed
+    add_requests_stats(request['message_data'])
+
+
+async def update_outbox_user_requests_history(request: Dict) -> None:
+    for chat_id in [request['chat_id']] + request.get('subscribers', []):
+        update_user_requests_history(chat_id, get_outbox_message_ids(request))
+
+
+async def send_outbox_success_message(request: Dict) -> None:
+    await send_success_message_for_user(request['chat_id'], request['steps_message_ids']['message'],
+                                        request['message_data']['category'])
+    for chat_id in request.get('subscribers', []):
+        await send_request_already_exists_message(chat_id, request['steps_message_ids']['message'])
+
+
+async def resume_outbox_requests() -> None:
+    now = get_current_timestamp()
+    for outbox_key, request in list(CONTEXT['outbox'].items()):
+        if outbox_key in OUTBOX_IN_PROGRESS or request['next_attempt'] > now:
+            continue
+
+        OUTBOX_IN_PROGRESS.add(outbox_key)
+        pending_request = reserve_request_hash(request['request_hash'])
+        try:
+            logging.info('Resuming request %s publication after steps %s', outbox_key, request['done_steps'])
+            await process_outbox_request(outbox_key)
+            increment_metric('outbox_resumed')
+        except Exception as e:
+            logging.exception('Unable to resume request %s publication', outbox_key)
+            request['attempts'] += 1
+            if request['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                await park_outbox_request(outbox_key, request, e)
+                continue
+            # back off, so request broken for good does not flood Telegram
+            request['next_attempt'] = now + min(OUTBOX_RESUME_INTERVAL_SECS * 2 ** request['attempts'],
+                                                OUTBOX_MAX_RESUME_INTERVAL_SECS) * 1000
+            await save_outbox_request(outbox_key, request)
+        finally:
+            OUTBOX_IN_PROGRESS.discard(outbox_key)
+            release_request_hash(request['request_hash'], pending_request)
+
+
+async def park_outbox_request(outbox_key: str, request: Dict, error: Exception) -> None:
+    # request is kept for investigation, but not retried anymore
+    request['error'] = repr(error)
+    CONTEXT['outbox'].pop(outbox_key, None)
+    CONTEXT.setdefault('outbox_parked', {})[outbox_key] = request
+    await run_io(save_context_entries, [('outbox', outbox_key, None),
+                                        ('outbox_parked', outbox_key, copy.deepcopy(request))])
+    increment_metric('outbox_parked')
+
+    message = 'Заявка ' + outbox_key + ' не опубликована после ' + str(request['attempts']) + \
+              ' попыток и отложена:\n' + request['error'] + '\n\n' + request['message']
+    for superuser_id in CONFIG['superusers']:
+        try:
+            await OUTBOUND.send(SEND_PRIORITY_ERROR_REPORT, 'send_message',
+                                chat_id=superuser_id,
+                                text=message)
+        except TelegramError:
+            logging.exception('Unable to notify %s about parked request %s', superuser_id, outbox_key)
+
+
+def load_outbox() -> None:
+    CONTEXT.setdefault('outbox', {})
+    if CONTEXT['outbox']:
+        logging.info('Outbox has %s not published requests', len(CONTEXT['outbox']))
+
+
+async def send_attachment(attachment, chat_id, message_id=None, priority=SEND_PRIORITY_USER, caption=None):
     if isinstance(attachment, PhotoSize):
-        return await BOT.send_photo(photo=attachment,
-                                    chat_id=chat_id,
-                                    reply_to_message_id=message_id,
-                                    disable_notification=True)
+        return await OUTBOUND.send(priority, 'send_photo',
+                                   photo=attachment,
+                                   chat_id=chat_id,
+                                   caption=caption,
+                                   parse_mode='MarkdownV2' if caption else None,
+                                   reply_to_message_id=message_id,
+                                   disable_notification=caption is None)
 
     if isinstance(attachment, Animation):
-        return await BOT.send_animation(animation=attachment,
-                                        chat_id=chat_id,
-                                        reply_to_message_id=message_id,
-                                        disable_notification=True)
+        return await OUTBOUND.send(priority, 'send_animation',
+                                   animation=attachment,
+                                   chat_id=chat_id,
+                                   caption=caption,
+                                   parse_mode='MarkdownV2' if caption else None,
+                                   reply_to_message_id=message_id,
+                                   disable_notification=caption is None)
 
     if isinstance(attachment, Video):
-        return await BOT.send_video(video=attachment,
-                                    chat_id=chat_id,
-                                    reply_to_message_id=message_id,
-                                    disable_notification=True)
-
-
-async def send_location(location, chat_id, message_id=None):
-    return await BOT.send_location(location=location,
+        return await OUTBOUND.send(priority, 'send_video',
+                                   video=attachment,
                                    chat_id=chat_id,
+                                   caption=caption,
+                                   parse_mode='MarkdownV2' if caption else None,
                                    reply_to_message_id=message_id,
-                                   disable_notification=True)
+                                   disable_notification=caption is None)
+
 
+async def send_location(location, chat_id, message_id=None, priority=SEND_PRIORITY_USER):
+    return await OUTBOUND.send(priority, 'send_location',
+                               location=location,
+                               chat_id=chat_id,
+                               reply_to_message_id=message_id,
+                               disable_notification=True)
 
-async def send_success_message_for_user(update: Update, message_id: int) -> None:
+
+async def send_success_message_for_user(chat_id: int, message_id: int, category: str) -> None:
     message_link = encode_markdown(CONFIG['groups']['main']['public_link'] + '/' + str(message_id))
 
     message = CONFIG['messages_templates']['success'].format(
         message_link=message_link
     )
 
-    keyboard = form_initial_keyboard()
-
-    await BOT.send_message(text=message,
-                           chat_id=update.effective_chat.id,
-                           parse_mode='MarkdownV2',
-                           reply_markup=keyboard)
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        text=message,
+                        chat_id=chat_id,
+                        parse_mode='MarkdownV2',
+                        reply_markup=KEYBOARDS['initial'])
 
-    if 'пожар' in get_user_context(update).get('selected_category').lower():
-        await BOT.send_message(text=CONFIG['messages_templates']['request_fire_hint'],
-                               chat_id=update.effective_chat.id)
+    if CATEGORIES_FLAGS.get(category, {}).get('fire'):
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=CONFIG['messages_templates']['request_fire_hint'],
+                            chat_id=chat_id)
 
 
-def get_request_hash(user_context):
-    return hash((
+def get_request_hash(user_context) -> str:
+    # must be the same in every process and after restarts, so built-in hash() is not suitable
+    fields = [
         user_context.get('selected_category'),
         user_context.get('selected_problem_area'),
         user_context.get('selected_street'),
@@ -276,7 +896,9 @@ def get_request_hash(user_context):
         user_context.get('selected_flat'),
         user_context.get('selected_storeroom'),
         user_context.get('selected_parking')
-    ))
+    ]
+    normalized_fields = ['' if field is None else str(field).strip().lower() for field in fields]
+    return hashlib.sha256('\x1f'.join(normalized_fields).encode('UTF-8')).hexdigest()
 
 
 def get_userid_from_update(update: Update or int) -> int:
@@ -289,13 +911,18 @@ def get_userid_from_update(update: Update or int) -> int:
 
 
 def get_user_context(update: Update or int) -> Dict:
-    return CONTEXT['users'].get(get_userid_from_update(update), {})
+    user_context = STORAGE.get_user(get_userid_from_update(update))
+    return user_context if user_context is not None else {}
 
 
 def set_user_context(update: Update, user_context: Dict) -> None:
-    CONTEXT['users'][get_userid_from_update(update)] = user_context
-    global IS_CONTEXT_CHANGED
-    IS_CONTEXT_CHANGED = True
+    user_id = get_userid_from_update(update)
+    STORAGE.set_user(user_id, user_context)
+    mark_context_changed('users', user_id)
+
+
+def mark_context_changed(section: str, key: Any) -> None:
+    DIRTY_CONTEXT_ENTRIES.add((section, key))
 
 
 def update_user_context(update: Update or int, key: str, value: Any, overwrite=True) -> None:
@@ -328,10 +955,35 @@ def update_user_requests_history(update: Update, messages_ids: List) -> None:
     for message_id in messages_ids:
         if message_id not in requests_history:
             requests_history.append(message_id)
+        add_request_subscriber(message_id, get_userid_from_update(update))
     update_user_context(update, 'requests_history', requests_history)
     update_user_context(update, 'last_request', get_current_timestamp())
 
 
+def add_request_subscriber(message_id: int, user_id: int) -> None:
+    subscribers = CONTEXT['requests_subscribers'].setdefault(message_id, set())
+    if user_id not in subscribers:
+        subscribers.add(user_id)
+        mark_context_changed('requests_subscribers', message_id)
+
+
+def get_request_subscribers(message_id: int) -> set:
+    return CONTEXT['requests_subscribers'].get(message_id, set())
+
+
+def build_requests_subscribers_index() -> None:
+    if CONTEXT.get('requests_subscribers'):
+        CONTEXT['requests_subscribers'] = {message_id: set(users_ids)
+                                           for message_id, users_ids in CONTEXT['requests_subscribers'].items()}
+        return
+
+    # context saved before index existed - build it from users requests history
+    CONTEXT['requests_subscribers'] = {}
+    for user_id, user_data in STORAGE.iter_users():
+        for message_id in user_data.get('requests_history') or []:
+            add_request_subscriber(message_id, user_id)
+
+
 def form_keyboard(buttons: List,
                   add_control_buttons=True,
                   add_send_geolocation=False) -> ReplyKeyboardMarkup:
@@ -378,131 +1030,361 @@ async def update_dialog_state(update, state) -> None:
 
     update_user_context(update, 'dialog_state', state)
     update_user_context(update, 'dialog_state_updated', get_current_timestamp())
+
+    prompt = DIALOG_PROMPTS.get(state)
+    if prompt is not None:
+        await prompt(update)
+
+
+async def send_dialog_prompt(text: str, keyboard: ReplyKeyboardMarkup or ReplyKeyboardRemove or None,
+                             update: Update) -> None:
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id,
+                        text=text,
+                        reply_markup=keyboard)
+
+
+async def send_address_prompt(text: str, context_keys: List[str], update: Update) -> None:
+    # only houses, sections or floors existing at the selected address are offered
+    user_context = get_user_context(update)
+    keyboard = ADDRESS_KEYBOARDS.get(tuple(user_context.get(key) for key in context_keys))
+    await send_dialog_prompt(text, keyboard, update)
+
+
+async def send_confirm_prompt(text: str, update: Update) -> None:
     chat_id = update.effective_chat.id
 
-    if state == 'start':
-        keyboard = form_initial_keyboard()
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['start'],
-                               reply_markup=keyboard)
+    if await validate_request_already_exists(update):
         return
 
-    if state == 'select_street':
-        keyboard = form_keyboard(CONFIG['keyphrases']['supported_streets'])
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_street'],
-                               reply_markup=keyboard)
-        return
+    request_body, attachment, location, _ = build_request(update)
+    message = text + '\n\n' + "\n".join(request_body.split('\n')[:-1])
 
-    if state == 'select_house_number':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_house_number'])
-        return
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=chat_id,
+                        text=message,
+                        parse_mode='MarkdownV2',
+                        reply_markup=KEYBOARDS['confirmation'])
 
-    if state == 'select_problem_area':
-        keyboard = form_keyboard(CONFIG['keyphrases']['problem_areas'], add_send_geolocation=True)
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_problem_area'],
-                               reply_markup=keyboard)
-        return
+    if location:
+        await send_location(location, chat_id)
 
-    elif state == 'select_section_number':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_section_number'])
+    if attachment:
+        await send_attachment(attachment, chat_id)
 
-    if state == 'select_floor_number':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_floor_number'])
-        return
 
-    if state == 'select_flat_number':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_flat_number'])
-        return
+def form_yes_no_keyboard() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup([
+        [KeyboardButton('Да'), KeyboardButton('Нет')]
+    ], resize_keyboard=False, one_time_keyboard=True)
 
-    if state == 'select_storeroom_number':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_storeroom_number'])
-        return
 
-    if state == 'select_parking_number':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['select_parking_number'])
-        return
+def build_keyboards() -> None:
+    # telegram objects are immutable, so the same keyboards are sent to every user until config is loaded again
+    KEYBOARDS.clear()
+    KEYBOARDS.update({
+        'initial': form_initial_keyboard(),
+        'streets': form_keyboard(CONFIG['keyphrases']['supported_streets']),
+        'problem_areas': form_keyboard(CONFIG['keyphrases']['problem_areas'], add_send_geolocation=True),
+        'confirmation': form_keyboard(CONFIG['keyphrases']['confirmation']),
+        'yes_no': form_yes_no_keyboard(),
+        'remove': ReplyKeyboardRemove()
+    })
 
-    if state == 'specify_description':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['specify_description'],
-                               reply_markup=ReplyKeyboardRemove())
-        return
 
-    if state == 'confirm':
-        keyboard = form_keyboard(CONFIG['keyphrases']['confirmation'])
+def get_house_key(house: Any) -> str:
+    return str(house).lower().replace(' ', '')
 
-        if await validate_request_already_exists(update):
-            return
 
-        request_body, attachment, location = await send_request_to_main_group(update, dry_run=True)
-        message = encode_markdown(CONFIG['messages_templates']['confirm_request']) + '\n\n' + \
-                  "\n".join(request_body.split('\n')[:-1])
+def form_address_keyboard(buttons: List) -> ReplyKeyboardMarkup:
+    buttons_list = []
+    for i in range(0, len(buttons), ADDRESS_KEYBOARD_ROW_SIZE):
+        buttons_list.append([KeyboardButton(str(item)) for item in buttons[i:i + ADDRESS_KEYBOARD_ROW_SIZE]])
 
-        await BOT.send_message(chat_id=chat_id,
-                               text=message,
-                               parse_mode='MarkdownV2',
-                               reply_markup=keyboard)
+    for item in CONFIG['keyphrases']['control_buttons']:
+        buttons_list.append([KeyboardButton(item)])
 
-        if location:
-            await send_location(location, chat_id)
+    return ReplyKeyboardMarkup(buttons_list, resize_keyboard=False, one_time_keyboard=True)
 
-        if attachment:
-            await send_attachment(attachment, chat_id)
 
-        return
+def build_address_index() -> None:
+    # streets without buildings in config are validated by NUMBER_DIALOG_STATES bounds only
+    ADDRESS_INDEX.clear()
+    ADDRESS_KEYBOARDS.clear()
+    for street in CONFIG.get('streets') or []:
+        if not street.get('buildings'):
+            continue
 
-    if state == 'upload_photo':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['upload_photo'])
-        return
+        houses = ADDRESS_INDEX[street['name']] = {}
+        houses_numbers = []
+        for building in street['buildings']:
+            if not building.get('enabled', True):
+                continue
 
-    if state == 'confirm_suspect_object':
-        await BOT.send_message(chat_id=chat_id,
-                               text=CONFIG['messages_templates']['confirm_suspect_object'],
-                               reply_markup=ReplyKeyboardMarkup([
-                                   [KeyboardButton('Да'), KeyboardButton('Нет')]
-                               ], resize_keyboard=False, one_time_keyboard=True))
-        return
+            house = get_house_key(building['number'])
+            floors_per_section = houses[house] = tuple(building.get('floors_per_section') or [])
+            houses_numbers.append(building['number'])
+            if floors_per_section:
+                ADDRESS_KEYBOARDS[(street['name'], house)] = \
+                    form_address_keyboard(list(range(1, len(floors_per_section) + 1)))
+            for section, floors in enumerate(floors_per_section, 1):
+                ADDRESS_KEYBOARDS[(street['name'], house, section)] = form_address_keyboard(list(range(1, floors + 1)))
+
+        if houses_numbers:
+            ADDRESS_KEYBOARDS[(street['name'],)] = form_address_keyboard(houses_numbers)
+
+    logging.info('Address index built for %s buildings', sum(len(houses) for houses in ADDRESS_INDEX.values()))
+
+
+def get_number_bounds(user_context: Dict, dialog_state: str) -> Tuple[int, int]:
+    _, min_value, max_value = NUMBER_DIALOG_STATES[dialog_state]
+    floors_per_section = ADDRESS_INDEX.get(user_context.get('selected_street'), {}) \
+        .get(user_context.get('selected_house'))
+    if not floors_per_section:
+        return min_value, max_value
+
+    if dialog_state == 'select_section_number':
+        return 1, len(floors_per_section)
+
+    if dialog_state == 'select_floor_number':
+        section = user_context.get('selected_section')
+        if section is not None and 1 <= section <= len(floors_per_section):
+            return min_value, floors_per_section[section - 1]
+        return min_value, max(floors_per_section)
+
+    return min_value, max_value
+
+
+def get_default_category_route(category: str) -> List[str] or None:
+    # fire alarm is checked in the whole section, so problem area is not asked
+    if 'пожар' in category.lower():
+        return ['select_section_number', 'confirm']
+    return None
+
+
+def get_default_problem_area_route(problem_area: str) -> List[str]:
+    problem_area = problem_area.lower()
+    if 'этаж' in problem_area:
+        return ['select_section_number', 'select_floor_number', 'confirm']
+    if 'квартир' in problem_area:
+        return ['select_section_number', 'select_floor_number', 'select_flat_number', 'confirm']
+    if 'парк' in problem_area:
+        return ['select_parking_number', 'confirm']
+    if 'кладовк' in problem_area:
+        return ['select_section_number', 'select_storeroom_number', 'confirm']
+    return ['specify_description', 'confirm']
+
+
+def build_dialog_tables() -> None:
+    # routes are states asked after house number for a category, or after problem area otherwise
+    dialog_routes = CONFIG.get('dialog_routes') or {}
+    categories_routes = dialog_routes.get('categories') or {}
+    problem_areas_routes = dialog_routes.get('problem_areas') or {}
+
+    CATEGORIES_FLAGS.clear()
+    CATEGORIES_ROUTES.clear()
+    for category in CONFIG['keyphrases']['issues_categories']:
+        CATEGORIES_FLAGS[category] = {
+            'fire': 'пожар' in category.lower(),
+            'suspect_object': 'вещь' in category.lower()
+        }
+        route = categories_routes.get(category, get_default_category_route(category))
+        if route:
+            CATEGORIES_ROUTES[category] = route
+
+    # selected problem area is saved in lower case
+    PROBLEM_AREAS_ROUTES.clear()
+    for problem_area in CONFIG['keyphrases']['problem_areas']:
+        route = problem_areas_routes.get(problem_area) or get_default_problem_area_route(problem_area)
+        PROBLEM_AREAS_ROUTES[problem_area.lower()] = route
+    PROBLEM_AREAS_ROUTES[LOCATION_PROBLEM_AREA] = problem_areas_routes.get(LOCATION_PROBLEM_AREA) or \
+        ['specify_description', 'confirm']
+
+    for route in list(CATEGORIES_ROUTES.values()) + list(PROBLEM_AREAS_ROUTES.values()):
+        for state in route:
+            if state not in DIALOG_HANDLERS:
+                raise ValueError('Unknown dialog state in route', state)
+
+    # prompts are bound to their texts and keyboards, built with keyboards on config load
+    templates = CONFIG['messages_templates']
+    DIALOG_PROMPTS.clear()
+    DIALOG_PROMPTS.update({
+        'start': functools.partial(send_dialog_prompt, templates['start'], KEYBOARDS['initial']),
+        'select_street': functools.partial(send_dialog_prompt, templates['select_street'], KEYBOARDS['streets']),
+        'select_problem_area': functools.partial(send_dialog_prompt, templates['select_problem_area'],
+                                                 KEYBOARDS['problem_areas']),
+        'specify_description': functools.partial(send_dialog_prompt, templates['specify_description'],
+                                                 KEYBOARDS['remove']),
+        'confirm': functools.partial(send_confirm_prompt, encode_markdown(templates['confirm_request'])),
+        'upload_photo': functools.partial(send_dialog_prompt, templates['upload_photo'], None),
+        'confirm_suspect_object': functools.partial(send_dialog_prompt, templates['confirm_suspect_object'],
+                                                    KEYBOARDS['yes_no'])
+    })
+    for state in NUMBER_DIALOG_STATES:
+        DIALOG_PROMPTS[state] = functools.partial(send_dialog_prompt, templates[state], None)
+    for state, context_keys in ADDRESS_PROMPTS_CONTEXT_KEYS.items():
+        DIALOG_PROMPTS[state] = functools.partial(send_address_prompt, templates[state], context_keys)
+
+
+def get_dialog_route(user_context: Dict) -> List[str]:
+    route = CATEGORIES_ROUTES.get(user_context.get('selected_category'))
+    if route is None:
+        route = PROBLEM_AREAS_ROUTES.get(user_context.get('selected_problem_area'), [])
+    return route
+
+
+def get_next_dialog_state(update: Update, dialog_state: str) -> str:
+    route = get_dialog_route(get_user_context(update))
+    if dialog_state in route[:-1]:
+        return route[route.index(dialog_state) + 1]
+    return 'confirm'
 
 
 async def proceed_fallback(update: Update, last_state) -> None:
-    await BOT.send_message(chat_id=update.effective_chat.id,
-                           text=CONFIG['messages_templates']['fallback'])
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id,
+                        text=CONFIG['messages_templates']['fallback'])
     await update_dialog_state(update, last_state)
 
 
 async def proceed_bad_words_fallback(update: Update, last_state) -> None:
-    await BOT.send_message(chat_id=update.effective_chat.id,
-                           text=CONFIG['messages_templates']['bad_words_fallback'])
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id,
+                        text=CONFIG['messages_templates']['bad_words_fallback'])
     await update_dialog_state(update, last_state)
 
 
 async def bad_words_found(message) -> bool:
-    return profanity.contains_profanity(message)
+    # same verdict as profanity.contains_profanity: words are runs of its allowed chars, each word alone and
+    # joined with up to MAX_NUMBER_COMBINATIONS next words, together or with separators kept, is compared
+    # with bad words, but by prefix tree regexes instead of every bad word one by one
+    words = [match.span() for match in BAD_WORDS_WORD_REGEX.finditer(message)]
+    if not words or words[0][0] >= len(message) - 1:
+        return False
+
+    for index, (start, end) in enumerate(words):
+        word = message[start:end].lower()
+        if BAD_WORDS_PREFIXES_REGEX.fullmatch(word) is None:
+            continue
+        if BAD_WORDS_REGEX.fullmatch(word) is not None:
+            return True
+
+        joined_words = word
+        for next_start, next_end in words[index + 1:index + 1 + profanity.MAX_NUMBER_COMBINATIONS]:
+            # better_profanity never joins one char word at the very end of message
+            if next_start >= len(message) - 1:
+                break
+            joined_words += message[next_start:next_end].lower()
+            separated_words = message[start:next_end].lower()
+            if BAD_WORDS_REGEX.fullmatch(joined_words) is not None or \
+                    BAD_WORDS_REGEX.fullmatch(separated_words) is not None:
+                return True
+            if BAD_WORDS_PREFIXES_REGEX.fullmatch(joined_words) is None and \
+                    BAD_WORDS_PREFIXES_REGEX.fullmatch(separated_words) is None:
+                break
+
+    return False
+
+
+def get_bad_word_char_pattern(char: str) -> str:
+    if char in profanity.CHARS_MAPPING:
+        return '[' + ''.join(re.escape(variant) for variant in profanity.CHARS_MAPPING[char]) + ']'
+    return re.escape(char)
+
+
+def build_bad_words_regex() -> None:
+    # default better_profanity words with configured ones, with the same chars substitutions
+    trie = {}
+    prefixes_trie = {}
+    for word in [str(word) for word in profanity.CENSOR_WORDSET] + CONFIG['bad_words']:
+        word = str(word).lower()
+        add_to_trie(trie, word)
+        for length in range(1, len(word) + 1):
+            add_to_trie(prefixes_trie, word[:length])
+
+    global BAD_WORDS_REGEX, BAD_WORDS_PREFIXES_REGEX, BAD_WORDS_WORD_REGEX
+    BAD_WORDS_REGEX = re.compile(build_trie_pattern(trie, get_bad_word_char_pattern) or '(?!)')
+    BAD_WORDS_PREFIXES_REGEX = re.compile(build_trie_pattern(prefixes_trie, get_bad_word_char_pattern) or '(?!)')
+    BAD_WORDS_WORD_REGEX = re.compile('[' + ''.join(re.escape(char) for char in sorted(profanity.ALLOWED_CHARACTERS)) +
+                                      ']+')
+
+
+def sanitize_description(message: str) -> str:
+    # remove any links, emails and etc
+    message = clean(message,
+                    fix_unicode=True,
+                    to_ascii=False,
+                    lower=False,
+                    no_line_breaks=False,
+                    no_urls=True,
+                    no_emails=True,
+                    no_phone_numbers=True,
+                    replace_with_url="",
+                    replace_with_email="",
+                    replace_with_phone_number="",
+                    lang="ru")
+
+    # remove newlines with beautiful sentence ending
+    message = message.replace(",\n", ", ").replace("!\n", "! ").replace(":\n", ": ").replace("\n", ". ").replace(".. ", ". ").replace("  ", " ").replace(" . ", ". ")
+
+    # remove special chars
+    message = DESCRIPTION_SPECIAL_CHARS_REGEX.sub("", message)
+
+    # remove urls if they still exists
+    return DESCRIPTION_URLS_REGEX.sub("", message)
 
 
 async def validate_request_already_exists(update: Update):
     request_hash = get_request_hash(get_user_context(update))
 
-    for existing_request in RECENT_REQUESTS:
-        if existing_request['request_hash'] == request_hash:
-            message = f"{CONFIG['messages_templates']['request_already_exists']}\n{CONFIG['groups']['main']['public_link']}/{existing_request['message_id']}"
-            await BOT.send_message(chat_id=update.effective_chat.id,
-                                   text=message)
-            # write other's user message id to current user to receive notifications also
-            update_user_requests_history(update, [existing_request['message_id']])
-            await go_restart(update)
-            return True
+    # the same request confirmed by another user is being published right now, its message is awaited
+    pending_request = RECENT_REQUESTS_PENDING.get(request_hash)
+    while pending_request is not None:
+        await asyncio.shield(pending_request)
+        pending_request = RECENT_REQUESTS_PENDING.get(request_hash)
+
+    existing_request = find_recent_request(request_hash)
+    if existing_request is not None:
+        await send_request_already_exists_message(update.effective_chat.id, existing_request['message_id'])
+        # write other's user message id to current user to receive notifications also
+        update_user_requests_history(update, [existing_request['message_id']])
+        await go_restart(update)
+        return True
 
-    return False
+    # the same request is waiting in outbox for Telegram, user is notified and subscribed when it is published
+    outbox_key = find_outbox_request(request_hash)
+    if outbox_key is None:
+        return False
+
+    request = CONTEXT['outbox'][outbox_key]
+    if update.effective_chat.id == request['chat_id']:
+        if outbox_key == get_outbox_key(update):
+            # redelivered confirmation resumes the publication
+            return False
+        message = CONFIG['messages_templates'].get('request_queued',
+                                                   'Заявка принята и будет опубликована, '
+                                                   'как только Telegram станет доступен')
+    else:
+        subscribers = request.setdefault('subscribers', [])
+        if update.effective_chat.id not in subscribers:
+            subscribers.append(update.effective_chat.id)
+            await save_outbox_request(outbox_key, request)
+        message = CONFIG['messages_templates'].get('request_already_queued',
+                                                   'Ваш запрос уже был отправлен кем-то еще и будет '
+                                                   'опубликован, как только Telegram станет доступен')
+
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id,
+                        text=message)
+    await go_restart(update)
+    return True
+
+
+async def send_request_already_exists_message(chat_id: int, message_id: int) -> None:
+    message = f"{CONFIG['messages_templates']['request_already_exists']}\n{CONFIG['groups']['main']['public_link']}/{message_id}"
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=chat_id,
+                        text=message)
 
 
 async def start(update: Update, _):
@@ -513,8 +1395,9 @@ async def start(update: Update, _):
     update_user_context(update, 'bot_started', get_current_timestamp(), overwrite=False)
     reset_user_context(update)
 
-    await BOT.send_message(chat_id=update.effective_chat.id,
-                           text=CONFIG['messages_templates']['welcome'])
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id,
+                        text=CONFIG['messages_templates']['welcome'])
     await update_dialog_state(update, 'start')
 
 
@@ -537,9 +1420,10 @@ async def send_pin_message(update: Update, _):
 
     text = CONFIG['messages_templates']['pin_message'] + '\n\n' + CONFIG['messages_templates']['rules']
 
-    await BOT.send_message(chat_id=CONFIG['groups']['main']['id'],
-                           text=text,
-                           reply_markup=inline_keyboard_markup)
+    await OUTBOUND.send(SEND_PRIORITY_MAIN_GROUP, 'send_message',
+                        chat_id=CONFIG['groups']['main']['id'],
+                        text=text,
+                        reply_markup=inline_keyboard_markup)
 
 
 async def reset_all_users_current_state(update: Update, _):
@@ -551,12 +1435,13 @@ async def reset_all_users_current_state(update: Update, _):
     if update.effective_user.id not in CONFIG['superusers']:
         return
 
-    for user_id, user_data in CONTEXT['users'].items():
+    for user_id in STORAGE.iter_user_ids():
         reset_user_context(user_id)
 
-    save_context()
+    await save_context_async()
 
-    await BOT.send_message(chat_id=update.effective_chat.id, text='Готово')
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id, text='Готово')
 
 
 def get_current_time():
@@ -574,15 +1459,641 @@ async def current_time(update: Update, _):
 
     message = str(get_current_time())
 
-    await BOT.send_message(chat_id=update.effective_chat.id, text=message)
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id, text=message)
+
+
+async def update_requests_history(message_id, message_data) -> asyncio.Future:
+    return await REQUESTS_LOG.write(message_id, message_data)
+
+
+def get_requests_stats_key(day: str, hour: int, category: str or None, house: Any, section: Any) -> str:
+    house = None if house is None else str(house)
+    section = None if section is None else str(section)
+    return json.dumps([day, hour, category, house, section], ensure_ascii=False, separators=(',', ':'))
+
+
+def index_requests_stats(day: str, hour: int, category: str or None, house: str or None, section: str or None,
+                         count: int) -> None:
+    if day not in REQUESTS_STATS_BY_DAY:
+        REQUESTS_STATS_BY_DAY[day] = Counter()
+        bisect.insort(REQUESTS_STATS_DAYS, day)
+    REQUESTS_STATS_BY_DAY[day][(hour, category, house, section)] += count
+
+
+def add_requests_stats(message_data: Dict, count: int = 1) -> None:
+    # date is saved in bot timezone, so day and hour are taken as is
+    day, hour = message_data['date'][:10], int(message_data['date'][11:13])
+    category, house, section = message_data.get('category'), message_data.get('house'), message_data.get('section')
+    request_stats_key = get_requests_stats_key(day, hour, category, house, section)
+    CONTEXT['requests_stats'][request_stats_key] = CONTEXT['requests_stats'].get(request_stats_key, 0) + count
+    mark_context_changed('requests_stats', request_stats_key)
+    index_requests_stats(*json.loads(request_stats_key), count)
+
+
+def format_requests_history_line(message_id, message_data) -> bytes:
+    return (str(message_id) + " " + json.dumps(message_data, ensure_ascii=False, separators=(',', ':')) + "\n") \
+        .encode('UTF-8')
 
 
-def update_requests_history(message_id, message_data):
-    with open("requests.txt", "a", encoding="UTF-8") as f:
-        f.write(str(message_id) + " " + json.dumps(message_data, ensure_ascii=False, separators=(',', ':')) + "\n")
+def parse_requests_history_line(line: bytes) -> Tuple[int, Dict]:
+    [message_id_str, message_data_json] = line.decode('UTF-8').strip().split(' ', 1)
+    return int(message_id_str), json.loads(message_data_json)
 
 
-async def export_requests_database(update: Update, _):
+def get_request_timestamp(message_data: Dict) -> int:
+    return round(datetime.datetime.fromisoformat(message_data['date']).timestamp() * 1000)
+
+
+def open_requests_segment(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+class RequestsColumnarCache:
+    # columns of one segment for fast exports and statistics:
+    #   low cardinality fields are dictionary encoded, -1 code means no value
+    #   numbers are stored as floats, NaN means no value
+    #   texts are packed into one UTF-8 buffer with offsets
+
+    def __init__(self):
+        self.source_size = 0
+        self.message_ids: List[int] = []
+        self.dates: List[int] = []
+        self.users: List[int] = []
+        self.codes: Dict[str, List[int]] = {column: [] for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS}
+        self.vocabularies: Dict[str, List[str]] = {column: [] for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS}
+        self.vocabularies_codes: Dict[str, Dict[str, int]] = {column: {} for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS}
+        self.numbers: Dict[str, List[float]] = {column: [] for column in REQUESTS_CACHE_NUMERIC_COLUMNS}
+        self.texts: Dict[str, List[str or None]] = {column: [] for column in REQUESTS_CACHE_TEXT_COLUMNS}
+
+    def add(self, message_id: int, message_data: Dict) -> None:
+        self.message_ids.append(message_id)
+        self.dates.append(get_request_timestamp(message_data))
+        self.users.append(message_data.get('user') or -1)
+
+        for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS:
+            value = message_data.get(column)
+            if value is None:
+                self.codes[column].append(-1)
+                continue
+
+            value = str(value)
+            code = self.vocabularies_codes[column].get(value)
+            if code is None:
+                code = self.vocabularies_codes[column][value] = len(self.vocabularies[column])
+                self.vocabularies[column].append(value)
+            self.codes[column].append(code)
+
+        for column in REQUESTS_CACHE_NUMERIC_COLUMNS:
+            try:
+                self.numbers[column].append(float(message_data.get(column)))
+            except (TypeError, ValueError):
+                self.numbers[column].append(float('nan'))
+
+        for column in REQUESTS_CACHE_TEXT_COLUMNS:
+            value = message_data.get(column)
+            self.texts[column].append(None if value is None else str(value))
+
+    def save(self, path: str) -> None:
+        arrays = {
+            'source_size': np.array(self.source_size, dtype=np.int64),
+            'message_id': np.array(self.message_ids, dtype=np.int64),
+            'date': np.array(self.dates, dtype=np.int64),
+            'user': np.array(self.users, dtype=np.int64)
+        }
+        for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS:
+            arrays[column + '_codes'] = np.array(self.codes[column], dtype=np.int32)
+            arrays[column + '_vocabulary'] = np.array(self.vocabularies[column], dtype=np.str_)
+        for column in REQUESTS_CACHE_NUMERIC_COLUMNS:
+            arrays[column] = np.array(self.numbers[column], dtype=np.float64)
+        for column in REQUESTS_CACHE_TEXT_COLUMNS:
+            encoded = [b'' if value is None else value.encode('UTF-8') for value in self.texts[column]]
+            arrays[column + '_data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            arrays[column + '_offsets'] = np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64)
+            arrays[column + '_nulls'] = np.array([value is None for value in self.texts[column]], dtype=np.bool_)
+
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path: str) -> 'RequestsColumnarCache':
+        cache = RequestsColumnarCache()
+        with np.load(path) as arrays:
+            cache.source_size = int(arrays['source_size'])
+            cache.message_ids = arrays['message_id'].tolist()
+            cache.dates = arrays['date'].tolist()
+            cache.users = arrays['user'].tolist()
+            for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS:
+                cache.codes[column] = arrays[column + '_codes'].tolist()
+                cache.vocabularies[column] = arrays[column + '_vocabulary'].tolist()
+                cache.vocabularies_codes[column] = {value: code for code, value in enumerate(cache.vocabularies[column])}
+            for column in REQUESTS_CACHE_NUMERIC_COLUMNS:
+                cache.numbers[column] = arrays[column].tolist()
+            for column in REQUESTS_CACHE_TEXT_COLUMNS:
+                cache.texts[column] = read_requests_cache_texts(arrays, column)
+        return cache
+
+
+def read_requests_cache_source_size(path: str) -> int or None:
+    if not isfile(path):
+        return None
+    try:
+        with np.load(path) as arrays:
+            return int(arrays['source_size'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_requests_cache_texts(arrays, column: str, rows: np.ndarray = None) -> List[str or None]:
+    data = arrays[column + '_data'].tobytes()
+    offsets = arrays[column + '_offsets']
+    nulls = arrays[column + '_nulls']
+    if rows is None:
+        rows = range(len(nulls))
+    return [None if nulls[row] else data[offsets[row]:offsets[row + 1]].decode('UTF-8') for row in rows]
+
+
+def load_requests_cache_frame(path: str, date_from: int or None, date_to: int or None,
+                              rows: List[int] or None, timezone: str) -> pd.DataFrame:
+    # rows matching fields filters are found by the segment postings, only dates are checked here
+    with np.load(path) as arrays:
+        dates = arrays['date']
+        rows = np.arange(len(dates)) if rows is None else np.array(rows, dtype=np.int64)
+        mask = np.ones(len(rows), dtype=np.bool_)
+        if date_from is not None:
+            mask &= dates[rows] >= date_from
+        if date_to is not None:
+            mask &= dates[rows] <= date_to
+
+        rows = rows[mask]
+        columns = {
+            'date': pd.to_datetime(dates[rows], unit='ms', utc=True).tz_convert(timezone).tz_localize(None),
+            'user': arrays['user'][rows]
+        }
+        for column in REQUESTS_CACHE_CATEGORICAL_COLUMNS:
+            columns[column] = pd.Categorical.from_codes(arrays[column + '_codes'][rows],
+                                                        categories=arrays[column + '_vocabulary'])
+        for column in REQUESTS_CACHE_NUMERIC_COLUMNS:
+            columns[column] = pd.array(arrays[column][rows], dtype='Int64')
+        for column in REQUESTS_CACHE_TEXT_COLUMNS:
+            columns[column] = read_requests_cache_texts(arrays, column, rows)
+
+        return pd.DataFrame(columns, index=pd.Index(arrays['message_id'][rows], name='message_id'),
+                            columns=REQUESTS_EXPORT_COLUMNS)
+
+
+class RequestsLogSegment:
+    # one month of requests log with its index and columnar cache,
+    # index keeps every REQUESTS_SPARSE_INDEX_STEP-th record as [timestamp, message_id, offset], ordered by time,
+    # offsets are positions in uncompressed data, so they stay valid after the segment is compressed,
+    # postings keep rows of the columnar cache for every value of filterable fields
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.path = os.path.join(directory, name + '.txt')
+        self.index_path = os.path.join(directory, name + '.idx')
+        self.cache_path = os.path.join(directory, name + '.npz')
+        self.indexed_size = 0
+        self.records = 0
+        self.sparse: List[List[int]] = []
+        self.postings: Dict[str, Dict[str, List[int]]] = {field: {} for field in REQUESTS_FILTER_FIELDS}
+        self.unsaved_records = 0
+        # columns are kept in memory only for the segment being written
+        self.cache: RequestsColumnarCache or None = None
+
+        if not isfile(self.path) and isfile(self.path + '.gz'):
+            self.path += '.gz'
+
+    def reset(self) -> None:
+        self.indexed_size = 0
+        self.records = 0
+        self.sparse = []
+        self.postings = {field: {} for field in REQUESTS_FILTER_FIELDS}
+        self.unsaved_records = 0
+
+    def is_compressed(self) -> bool:
+        return self.path.endswith('.gz')
+
+    def load(self) -> None:
+        index_loaded = False
+        if isfile(self.index_path):
+            with open(self.index_path, 'r', encoding='UTF-8') as f:
+                data = json.load(f)
+            # index without postings of all filterable fields is built again
+            if set(data.get('postings', {}).keys()) == set(REQUESTS_FILTER_FIELDS):
+                self.indexed_size = data['indexed_size']
+                self.records = data['records']
+                self.sparse = data['sparse']
+                self.postings = data['postings']
+                index_loaded = True
+        saved_size = self.indexed_size
+
+        if not isfile(self.path):
+            self.reset()
+            return
+
+        if not self.is_compressed():
+            if os.path.getsize(self.path) < self.indexed_size:
+                # segment was replaced, index is not valid anymore
+                self.reset()
+            self.terminate_last_record()
+
+        if not (self.is_compressed() and index_loaded):
+            # catch up with records written after the index was saved, compressed segments are not written anymore
+            for offset, next_offset, message_id, message_data in self.read_records(self.indexed_size):
+                self.add(offset, message_id, message_data)
+                self.indexed_size = next_offset
+            if not self.is_compressed():
+                # trailing broken records are skipped, but new records are appended after them
+                self.indexed_size = os.path.getsize(self.path)
+
+            if self.unsaved_records or self.indexed_size != saved_size or not index_loaded:
+                self.save()
+
+        if read_requests_cache_source_size(self.cache_path) != self.indexed_size:
+            self.rebuild_cache()
+
+    def terminate_last_record(self) -> None:
+        # last record could be truncated by crash during write, new records should not be glued to it
+        if os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+                logging.warning('Terminated broken last requests log record in %s', self.path)
+
+    def read_records(self, start_offset: int) -> Iterable[Tuple[int, int, int, Dict]]:
+        # yields offsets of the record and of the next record together with each record
+        with open_requests_segment(self.path) as f:
+            f.seek(start_offset)
+            offset = start_offset
+            for line in f:
+                try:
+                    message_id, message_data = parse_requests_history_line(line)
+                except ValueError:
+                    logging.warning('Skipping broken requests log record in %s at %s', self.path, offset)
+                    offset += len(line)
+                    continue
+                offset += len(line)
+                yield offset - len(line), offset, message_id, message_data
+
+    def rebuild_cache(self) -> None:
+        cache = RequestsColumnarCache()
+        for _, _, message_id, message_data in self.read_records(0):
+            cache.add(message_id, message_data)
+        cache.source_size = self.indexed_size
+        cache.save(self.cache_path)
+        logging.info('Requests cache %s rebuilt', self.cache_path)
+
+    def add(self, offset: int, message_id: int, message_data: Dict) -> None:
+        if self.records % REQUESTS_SPARSE_INDEX_STEP == 0:
+            self.sparse.append([get_request_timestamp(message_data), message_id, offset])
+
+        # rows of the columnar cache follow records order
+        for field in REQUESTS_FILTER_FIELDS:
+            value = normalize_requests_index_value(message_data.get(field))
+            if value is not None:
+                self.postings[field].setdefault(value, []).append(self.records)
+
+        if self.cache is not None:
+            self.cache.add(message_id, message_data)
+
+        self.records += 1
+        self.unsaved_records += 1
+
+    def save(self) -> None:
+        temp_filename = self.index_path + '.tmp'
+        with open(temp_filename, 'w', encoding='UTF-8') as f:
+            json.dump({
+                'indexed_size': self.indexed_size,
+                'records': self.records,
+                'sparse': self.sparse,
+                'postings': self.postings
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_filename, self.index_path)
+        self.unsaved_records = 0
+        self.save_cache()
+
+    def save_cache(self) -> None:
+        if self.cache is not None and self.cache.source_size != self.indexed_size:
+            self.cache.source_size = self.indexed_size
+            self.cache.save(self.cache_path)
+
+    def compress(self) -> None:
+        with open(self.path, 'rb') as source, gzip.open(self.path + '.gz.tmp', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(self.path + '.gz.tmp', self.path + '.gz')
+        os.unlink(self.path)
+        self.path += '.gz'
+
+    def first_timestamp(self) -> int or None:
+        return self.sparse[0][0] if self.sparse else None
+
+    def query(self, filters: Dict[str, str]) -> List[int] or None:
+        # rows matching all filters, None means no filters
+        rows = None
+        for field, value in filters.items():
+            field_postings = self.postings[field]
+            if field == 'category':
+                # category could be given by part of its name
+                matched_values = [key for key in field_postings.keys() if value in key]
+            else:
+                matched_values = [value] if value in field_postings else []
+
+            field_rows = set()
+            for matched_value in matched_values:
+                field_rows.update(field_postings[matched_value])
+            rows = field_rows if rows is None else rows & field_rows
+
+        return None if rows is None else sorted(rows)
+
+    def first_message_id(self) -> int or None:
+        return self.sparse[0][1] if self.sparse else None
+
+    def find(self, message_id: int) -> Dict or None:
+        # message ids grow with time, so the sparse index is ordered by them too
+        position = bisect.bisect_right(self.sparse, message_id, key=lambda entry: entry[1]) - 1
+        if position < 0:
+            return None
+
+        with open_requests_segment(self.path) as f:
+            f.seek(self.sparse[position][2])
+            records = 0
+            for line in f:
+                try:
+                    record_message_id, message_data = parse_requests_history_line(line)
+                except ValueError:
+                    # broken records are not counted by the index
+                    continue
+                if record_message_id == message_id:
+                    return message_data
+                records += 1
+                if records >= REQUESTS_SPARSE_INDEX_STEP:
+                    break
+
+        return None
+
+
+def normalize_requests_index_value(value: Any) -> str or None:
+    if value is None:
+        return None
+    return str(value).strip().lower()
+
+
+class RequestsLogWriter:
+    # requests are written into monthly segments, the previous segment is compressed when the next one starts
+    #
+    # durability policies:
+    #   always - every request is written and synced to disk before it is accepted
+    #   batch - requests are group-committed and synced by size or time threshold
+    #   os - requests are group-committed, syncing to disk is left to OS
+
+    def __init__(self, directory: str, durability: str, batch_size: int, compress_old_segments: bool):
+        if durability not in ['always', 'batch', 'os']:
+            raise ValueError('Unknown requests log durability policy', durability)
+
+        self.directory = directory
+        self.durability = durability
+        self.batch_size = batch_size
+        self.compress_old_segments = compress_old_segments
+        self.pending_records = []
+        # resolved when pending records are written by the group commit
+        self.pending_flushed: asyncio.Future or None = None
+        self.segments: List[RequestsLogSegment] = []
+        self.file = None
+
+    def load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        names = set()
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.txt') or filename.endswith('.txt.gz'):
+                names.add(filename.split('.')[0])
+
+        for name in sorted(names):
+            segment = RequestsLogSegment(self.directory, name)
+            segment.load()
+            self.segments.append(segment)
+
+        if self.segments and not self.segments[-1].is_compressed():
+            self.segments[-1].cache = RequestsColumnarCache.load(self.segments[-1].cache_path)
+
+    def migrate(self, filename: str) -> None:
+        # single requests log file from older versions is split into segments
+        if not isfile(filename):
+            return
+
+        with open(filename, 'rb') as f:
+            records = []
+            for line in f:
+                records.append(parse_requests_history_line(line))
+                if len(records) >= REQUESTS_MIGRATION_BATCH_RECORDS:
+                    self.write_records(records)
+                    records = []
+            self.write_records(records)
+
+        os.replace(filename, filename + '.migrated')
+        if isfile(filename + '.idx'):
+            os.unlink(filename + '.idx')
+        logging.info('Requests log %s migrated into %s', filename, self.directory)
+
+    async def write(self, message_id: int, message_data: Dict) -> asyncio.Future:
+        self.pending_records.append((message_id, message_data))
+        if self.pending_flushed is None:
+            self.pending_flushed = asyncio.get_running_loop().create_future()
+        flushed = self.pending_flushed
+
+        if self.durability == 'always':
+            await self.flush()
+        elif len(self.pending_records) >= self.batch_size:
+            run_in_background(self.flush())
+        return flushed
+
+    async def flush(self) -> None:
+        if not self.pending_records:
+            return
+
+        records = self.pending_records
+        flushed = self.pending_flushed
+        self.pending_records = []
+        self.pending_flushed = None
+        try:
+            await run_io(self.write_records, records)
+        except Exception as e:
+            flushed.set_exception(e)
+            raise
+        flushed.set_result(None)
+        increment_metric('requests_log_batches')
+        increment_metric('requests_log_lines', len(records))
+
+    def start_segment(self, name: str) -> None:
+        if self.segments:
+            self.close()
+            self.segments[-1].cache = None
+            if self.compress_old_segments and not self.segments[-1].is_compressed():
+                self.segments[-1].compress()
+
+        segment = RequestsLogSegment(self.directory, name)
+        segment.cache = RequestsColumnarCache()
+        self.segments.append(segment)
+
+    def write_records(self, records: List[Tuple[int, Dict]]) -> None:
+        # executed in the I/O thread
+        lines = []
+        for message_id, message_data in records:
+            # segments follow arrival order, a late request of the previous month stays in the current segment
+            name = 'requests-' + message_data['date'][:7]
+            if not self.segments or self.segments[-1].name < name:
+                self.write_lines(lines)
+                lines = []
+                self.start_segment(name)
+
+            segment = self.segments[-1]
+            line = format_requests_history_line(message_id, message_data)
+            lines.append(line)
+            segment.add(segment.indexed_size, message_id, message_data)
+            segment.indexed_size += len(line)
+
+        self.write_lines(lines)
+
+    def write_lines(self, lines: List[bytes]) -> None:
+        if not lines:
+            return
+
+        segment = self.segments[-1]
+        if self.file is None:
+            self.file = open(segment.path, 'ab')
+
+        self.file.writelines(lines)
+        self.file.flush()
+        if self.durability != 'os':
+            os.fsync(self.file.fileno())
+
+        if segment.unsaved_records >= REQUESTS_INDEX_SAVE_THRESHOLD:
+            segment.save()
+
+    def find(self, message_id: int) -> Dict or None:
+        # executed in the I/O thread
+        segments = [segment for segment in self.segments if segment.first_message_id() is not None]
+        position = bisect.bisect_right(segments, message_id, key=lambda segment: segment.first_message_id()) - 1
+        if position < 0:
+            return None
+        return segments[position].find(message_id)
+
+    def plan_export(self, date_from: int or None, date_to: int or None,
+                    filters: Dict[str, str]) -> List[Tuple[str, List[int] or None]]:
+        # executed in the I/O thread, returns columnar caches of segments overlapping with the dates range
+        # with rows matching the filters, segments without such rows are not read at all
+        parts = []
+        for i, segment in enumerate(self.segments):
+            if segment.first_timestamp() is None:
+                continue
+
+            next_segment_timestamp = self.segments[i + 1].first_timestamp() if i + 1 < len(self.segments) else None
+            if date_to is not None and segment.first_timestamp() > date_to + REQUESTS_INDEX_REORDER_MARGIN_MS:
+                continue
+            if date_from is not None and next_segment_timestamp is not None and \
+                    next_segment_timestamp < date_from - REQUESTS_INDEX_REORDER_MARGIN_MS:
+                continue
+
+            rows = segment.query(filters)
+            if rows is not None and not rows:
+                continue
+
+            segment.save_cache()
+            parts.append((segment.cache_path, rows))
+        return parts
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.segments:
+            self.segments[-1].save()
+
+
+def init_requests_log() -> RequestsLogWriter:
+    requests_log_config = CONFIG.get('requests_log', {})
+    requests_log = RequestsLogWriter(os.path.join(DATA_DIRECTORY, 'requests'),
+                                     requests_log_config.get('durability', 'batch'),
+                                     requests_log_config.get('batch_size', 50),
+                                     requests_log_config.get('compress_old_segments', True))
+    requests_log.load()
+    requests_log.migrate(os.path.join(DATA_DIRECTORY, 'requests.txt'))
+    return requests_log
+
+
+def build_requests_frame(message_ids: List[int], requests: List[Dict], timezone: str) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(requests, index=pd.Index(message_ids, name='message_id'),
+                                   columns=REQUESTS_EXPORT_COLUMNS)
+    df['date'] = pd.to_datetime(df['date'], utc=True).dt.tz_convert(timezone).dt.tz_localize(None)
+    return df
+
+
+def export_requests_cache(cache_path: str, date_from: int or None, date_to: int or None,
+                          rows: List[int] or None, timezone: str, part_filename: str) -> None:
+    # executed in a worker process
+    load_requests_cache_frame(cache_path, date_from, date_to, rows, timezone).to_pickle(part_filename)
+
+
+def assemble_requests_export(parts_filenames: List[str], export_filename: str, export_format: str) -> None:
+    # executed in a worker process, only one chunk is kept in memory at a time
+    if export_format == 'csv':
+        with open(export_filename, 'w', encoding='UTF-8', newline='') as f:
+            f.write(','.join(['message_id'] + REQUESTS_EXPORT_COLUMNS) + '\n')
+            for part_filename in parts_filenames:
+                pd.read_pickle(part_filename).to_csv(f, header=False)
+        return
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(['message_id'] + REQUESTS_EXPORT_COLUMNS)
+    for part_filename in parts_filenames:
+        df = pd.read_pickle(part_filename).astype(object)
+        df = df.where(df.notna(), None)
+        for row in df.itertuples(name=None):
+            worksheet.append(row)
+    workbook.save(export_filename)
+
+
+def parse_requests_export_arguments(args: List[str]) -> Tuple[str, int or None, int or None, Dict[str, str]]:
+    export_format = 'xlsx'
+    dates = []
+    filters = {}
+
+    for arg in args:
+        if arg.lower() in ['csv', 'xlsx']:
+            export_format = arg.lower()
+        elif '=' in arg:
+            field, value = arg.split('=', 1)
+            field = field.lower()
+            if field not in REQUESTS_FILTER_FIELDS:
+                raise ValueError('Unknown export filter', field)
+            filters[field] = normalize_requests_index_value(value)
+        else:
+            dates.append(datetime.date.fromisoformat(arg))
+
+    if len(dates) > 2:
+        raise ValueError('Too many dates', dates)
+
+    timezone = pytz.timezone(CONFIG['timezone'])
+    date_from = None
+    date_to = None
+    if len(dates) > 0:
+        date_from = timezone.localize(datetime.datetime.combine(dates[0], datetime.time.min))
+        date_from = round(date_from.timestamp() * 1000)
+    if len(dates) > 1:
+        date_to = timezone.localize(datetime.datetime.combine(dates[1], datetime.time.max))
+        date_to = round(date_to.timestamp() * 1000)
+
+    return export_format, date_from, date_to, filters
+
+
+async def export_requests_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ignore any messages from non-personal dialogs
     if update.effective_chat.type != 'private':
         return
@@ -591,43 +2102,108 @@ async def export_requests_database(update: Update, _):
     if update.effective_user.id not in CONFIG['superusers']:
         return
 
-    status_message = await BOT.send_message(chat_id=update.effective_chat.id, text='Подготовка 0% - чтение базы')
+    try:
+        export_format, date_from, date_to, filters = parse_requests_export_arguments(context.args or [])
+    except ValueError:
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            chat_id=update.effective_chat.id,
+                            text='Формат: /export_requests_database [с YYYY-MM-DD] [по YYYY-MM-DD] '
+                                 '[' + '|'.join(field + '=...' for field in REQUESTS_FILTER_FIELDS) + '] '
+                                 '[xlsx|csv]')
+        return
+
+    status_message = await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                                         chat_id=update.effective_chat.id, text='Подготовка 0% - чтение базы')
 
+    temp_filename = tempfile.gettempdir() + '/' + str(uuid.uuid4())
+    parts_filenames = []
     try:
-        requests = {}
-        with open("requests.txt", "r", encoding='UTF-8') as f:
-            for line in f:
-                [message_id_str, message_data_json] = line.strip().split(' ', 1)
-                message_id = int(message_id_str)
-                message_data = json.loads(message_data_json)
-                requests[message_id] = message_data
-
-        await status_message.edit_text('Подготовка 50% - упаковка в файл')
-        df = pd.DataFrame.from_dict(requests, orient='index')
-        df = df.reindex(
-            columns=['date', 'category', 'problem_area', 'address', 'street', 'house', 'section',
-                     'floor', 'flat', 'parking', 'storeroom', 'user', 'details', 'media_message',
-                     'media_type', 'geo'])
-        df['date'] = pd.to_datetime(df['date'])
-        df['date'] = df['date'].apply(lambda x: x.tz_localize(None))
-
-        temp_filename = tempfile.gettempdir() + '/' + str(uuid.uuid4()) + '.xlsx'
-        df.to_excel(temp_filename)
+        await REQUESTS_LOG.flush()
+
+        parts = await run_io(REQUESTS_LOG.plan_export, date_from, date_to, filters)
+
+        last_progress_update = time.monotonic()
+        for i, (cache_path, rows) in enumerate(parts):
+            part_filename = temp_filename + '.' + str(i) + '.pkl'
+            await run_cpu(export_requests_cache, cache_path, date_from, date_to, rows, CONFIG['timezone'],
+                          part_filename)
+            parts_filenames.append(part_filename)
+
+            # editing message too often hits Telegram limits
+            if time.monotonic() - last_progress_update > 2:
+                last_progress_update = time.monotonic()
+                await status_message.edit_text(f'Подготовка {round((i + 1) / len(parts) * 90)}% - чтение базы')
+
+        await status_message.edit_text('Подготовка 90% - упаковка в файл')
+        export_filename = temp_filename + '.' + export_format
+        await run_cpu(assemble_requests_export, parts_filenames, export_filename, export_format)
 
         await status_message.edit_text('Отправка файла...')
 
-        await BOT.sendDocument(chat_id=update.effective_chat.id,
-                               document=open(temp_filename, 'rb'),
-                               reply_to_message_id=update.message.message_id,
-                               filename='requests.xlsx')
+        # file is read by every send attempt, so it is uploaded again after flood wait
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_document',
+                            chat_id=update.effective_chat.id,
+                            document=Path(export_filename),
+                            reply_to_message_id=update.message.message_id,
+                            filename='requests.' + export_format)
 
         await status_message.edit_text('Готово')
-        os.unlink(temp_filename)
+        os.unlink(export_filename)
 
     except Exception as e:
         await status_message.edit_text('Произошла ошибка во время экспорта')
         raise e
 
+    finally:
+        for part_filename in parts_filenames:
+            os.unlink(part_filename)
+
+
+async def show_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # ignore any messages from non-personal dialogs
+    if update.effective_chat.type != 'private':
+        return
+
+    # if not enough rights - ignore command
+    if update.effective_user.id not in CONFIG['superusers']:
+        return
+
+    if not context.args or not context.args[0].isnumeric():
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            chat_id=update.effective_chat.id, text='Формат: /show_request <номер сообщения>')
+        return
+
+    await REQUESTS_LOG.flush()
+    message_data = await run_io(REQUESTS_LOG.find, int(context.args[0]))
+    if message_data is None:
+        message = 'Заявка не найдена'
+    else:
+        message = json.dumps(message_data, indent=2, ensure_ascii=False)
+
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id, text=message)
+
+
+async def export_context(update: Update, _):
+    # ignore any messages from non-personal dialogs
+    if update.effective_chat.type != 'private':
+        return
+
+    # if not enough rights - ignore command
+    if update.effective_user.id not in CONFIG['superusers']:
+        return
+
+    temp_filename = tempfile.gettempdir() + '/' + str(uuid.uuid4()) + '.yaml'
+    await save_context_async()
+    await run_io(STORAGE.export_yaml, temp_filename, copy.deepcopy(CONTEXT))
+
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_document',
+                        chat_id=update.effective_chat.id,
+                        document=Path(temp_filename),
+                        reply_to_message_id=update.message.message_id,
+                        filename='context.yaml')
+    os.unlink(temp_filename)
+
 
 def prepare_debug_data(update, context):
     user_context = get_user_context(update)
@@ -656,37 +2232,73 @@ async def handle_bot_exception(update, context):
               '\nDebug данные:\n```\n' + prepare_debug_data(update, context) + '\n```'
 
     for superuser_id in CONFIG['superusers']:
-        await BOT.send_message(chat_id=superuser_id,
-                               text=message,
-                               parse_mode='Markdown')
-
-
-def is_go_back_message(message):
+        await OUTBOUND.send(SEND_PRIORITY_ERROR_REPORT, 'send_message',
+                            chat_id=superuser_id,
+                            text=message,
+                            parse_mode='Markdown')
+
+
+def add_to_trie(trie: Dict, phrase: str) -> None:
+    node = trie
+    for char in phrase:
+        node = node.setdefault(char, {})
+    node[''] = True
+
+
+def build_trie_pattern(node: Dict, char_pattern=re.escape) -> str:
+    alternatives = [char_pattern(char) + build_trie_pattern(node[char], char_pattern)
+                    for char in sorted(node) if char]
+    if not alternatives:
+        return ''
+
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        # phrase could end here, but the longer one is preferred
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+def build_keyphrases_regex() -> None:
+    # all phrases are merged into a prefix tree, so at each position of a message only the branch
+    # of its next char is checked, instead of trying every phrase of every group
+    trie = {}
+    phrases_intents = {}
+    for intent in reversed(KEYPHRASES_INTENTS):
+        for phrase in CONFIG['keyphrases'][intent]:
+            phrase = phrase.lower()
+            phrases_intents[phrase] = intent
+            add_to_trie(trie, phrase)
+
+    # the longest phrase is matched at each position, phrases being its prefixes are matched there too
+    KEYPHRASES_INTENTS_BY_PHRASE.clear()
+    for phrase in phrases_intents:
+        prefixes_intents = [intent for prefix, intent in phrases_intents.items() if phrase.startswith(prefix)]
+        KEYPHRASES_INTENTS_BY_PHRASE[phrase] = min(prefixes_intents, key=KEYPHRASES_INTENTS.index)
+
+    global KEYPHRASES_REGEX
+    KEYPHRASES_REGEX = re.compile('(?=(' + (build_trie_pattern(trie) or '(?!)') + '))')
+
+
+def get_message_intent(message: str or None) -> Tuple[str or None, str or None]:
+    # returns the highest priority intent found in message and the phrase matched it
     if not message:
-        return False
-    message = message.lower()
-    for phrase in CONFIG['keyphrases']['go_back']:
-        if phrase in message:
-            return True
-    return False
+        return None, None
 
+    intent = None
+    phrase = None
+    for match in KEYPHRASES_REGEX.finditer(message.lower()):
+        match_intent = KEYPHRASES_INTENTS_BY_PHRASE[match.group(1)]
+        if intent is None or KEYPHRASES_INTENTS.index(match_intent) < KEYPHRASES_INTENTS.index(intent):
+            intent = match_intent
+            phrase = match.group(1)
+            if intent == KEYPHRASES_INTENTS[0]:
+                break
 
-def is_go_restart_message(message):
-    if not message:
-        return False
-    message = message.lower()
-    for phrase in CONFIG['keyphrases']['go_restart']:
-        if phrase in message:
-            return True
-    return False
+    return intent, phrase
 
 
 def is_go_confirm_message(message):
-    message = message.lower()
-    for phrase in CONFIG['keyphrases']['go_confirm']:
-        if phrase in message:
-            return True
-    return False
+    return get_message_intent(message)[0] == 'go_confirm'
 
 
 async def go_back(update):
@@ -710,14 +2322,57 @@ async def proceed_group_chat_message(update: Update) -> None:
     if (update.effective_message.from_user.id in CONFIG['responsible_persons']) \
             and update.effective_message.reply_to_message is not None \
             and update.effective_message.reply_to_message.forward_from_message_id is not None:
-        for user_id, user_data in CONTEXT['users'].items():
-            if user_data.get('requests_history') is not None and update.effective_message.reply_to_message.forward_from_message_id in user_data['requests_history']:
-                message = CONFIG['messages_templates']['received_response_from_responsible_person'] + update.effective_message.text + '\n\n' + update.effective_message.link
-                await BOT.send_message(text=message,
-                                       chat_id=user_id)
+        message = CONFIG['messages_templates']['received_response_from_responsible_person'] + update.effective_message.text + '\n\n' + update.effective_message.link
+        users_ids = get_request_subscribers(update.effective_message.reply_to_message.forward_from_message_id)
+        if users_ids:
+            # do not block group chat updates while response is delivered
+            run_in_background(deliver_responsible_person_response(update, list(users_ids), message))
         return
 
 
+async def deliver_responsible_person_response(update: Update, users_ids: List[int], message: str) -> None:
+    statuses = await asyncio.gather(*[send_notification(user_id, message) for user_id in users_ids])
+
+    for user_id, status in zip(users_ids, statuses):
+        logging.info('Response %s delivery to %s: %s', update.effective_message.id, user_id, status)
+
+    # complete delivery is not reported, so group members do not see a report for every response
+    if statuses.count('delivered') == len(statuses):
+        return
+
+    report = CONFIG['messages_templates'].get('response_delivery_report',
+                                              'Ответ доставлен: {delivered} из {total}, '
+                                              'бот заблокирован: {blocked}, ошибки: {failed}').format(
+        delivered=statuses.count('delivered'),
+        total=len(statuses),
+        blocked=statuses.count('blocked'),
+        failed=statuses.count('failed')
+    )
+
+    # report goes privately to the responsible person, group gets it only if the bot cannot write to them
+    if await send_notification(update.effective_message.from_user.id,
+                               report + '\n\n' + update.effective_message.link) == 'delivered':
+        return
+
+    await OUTBOUND.send(SEND_PRIORITY_NOTIFICATION, 'send_message',
+                        text=report,
+                        chat_id=update.effective_chat.id,
+                        reply_to_message_id=update.effective_message.id,
+                        disable_notification=True)
+
+
+async def send_notification(chat_id: int, message: str) -> str:
+    try:
+        await OUTBOUND.send(SEND_PRIORITY_NOTIFICATION, 'send_message',
+                            text=message, chat_id=chat_id)
+        return 'delivered'
+    except Forbidden:
+        return 'blocked'
+    except TelegramError:
+        logging.exception('Unable to deliver notification to %s', chat_id)
+        return 'failed'
+
+
 async def proceed_user_message(update: Update, _) -> None:
     if update.effective_chat.id == CONFIG['groups']['chat']['id']:
         return await proceed_group_chat_message(update)
@@ -725,11 +2380,11 @@ async def proceed_user_message(update: Update, _) -> None:
     if update.effective_chat.type != 'private':
         return
 
-    # TODO: this check is too slow
     if await is_user_banned(update):
-        await BOT.send_message(text=CONFIG['messages_templates']['access_restricted'],
-                               chat_id=update.effective_chat.id,
-                               reply_markup=ReplyKeyboardRemove())
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=CONFIG['messages_templates']['access_restricted'],
+                            chat_id=update.effective_chat.id,
+                            reply_markup=KEYBOARDS['remove'])
         reset_user_context(update)
         return
 
@@ -739,11 +2394,15 @@ async def proceed_user_message(update: Update, _) -> None:
     if update.effective_message.text:
         message = update.effective_message.text.strip()
 
-    if is_go_back_message(message):
+    intent, phrase = get_message_intent(message)
+    if intent is not None:
+        logging.debug('Message intent %s matched by phrase "%s"', intent, phrase)
+
+    if intent == 'go_back':
         await go_back(update)
         return
 
-    if is_go_restart_message(message):
+    if intent == 'go_restart':
         await go_restart(update)
         return
 
@@ -751,65 +2410,80 @@ async def proceed_user_message(update: Update, _) -> None:
         await update_dialog_state(update, 'start')
         return
 
-    # user selected request type -> validate type -> ask to select street
-    if dialog_state == 'start':
-        if not message:
-            await proceed_fallback(update, dialog_state)
-            return
+    handler = DIALOG_HANDLERS.get(dialog_state)
+    if handler is not None:
+        await handler(update, message, dialog_state)
 
-        if 'правила' in message.lower():
-            await BOT.send_message(text=CONFIG['messages_templates']['rules'],
-                                   chat_id=update.effective_chat.id,
-                                   reply_markup=form_initial_keyboard())
-            await BOT.send_message(text=COPYRIGHT_DISCLAIMER,
-                                   chat_id=update.effective_chat.id,
-                                   reply_markup=form_initial_keyboard(),
-                                   disable_web_page_preview=True)
-            return
 
-        if 'контакты' in message.lower():
-            await BOT.send_message(text=CONFIG['messages_templates']['contacts'],
-                                   chat_id=update.effective_chat.id,
-                                   reply_markup=form_initial_keyboard())
-            await BOT.send_message(text=COPYRIGHT_DISCLAIMER,
-                                   chat_id=update.effective_chat.id,
-                                   reply_markup=form_initial_keyboard(),
-                                   disable_web_page_preview=True)
-            return
+# user selected request type -> validate type -> ask to select street
+async def proceed_start_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not message:
+        await proceed_fallback(update, dialog_state)
+        return
 
-        if message not in CONFIG['keyphrases']['issues_categories']:
-            await proceed_fallback(update, dialog_state)
-            return
+    if 'правила' in message.lower():
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=CONFIG['messages_templates']['rules'],
+                            chat_id=update.effective_chat.id,
+                            reply_markup=KEYBOARDS['initial'])
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=COPYRIGHT_DISCLAIMER,
+                            chat_id=update.effective_chat.id,
+                            reply_markup=KEYBOARDS['initial'],
+                            disable_web_page_preview=True)
+        return
+
+    if 'контакты' in message.lower():
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=CONFIG['messages_templates']['contacts'],
+                            chat_id=update.effective_chat.id,
+                            reply_markup=KEYBOARDS['initial'])
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=COPYRIGHT_DISCLAIMER,
+                            chat_id=update.effective_chat.id,
+                            reply_markup=KEYBOARDS['initial'],
+                            disable_web_page_preview=True)
+        return
 
-        update_user_context(update, 'selected_category', message)
+    if message not in CATEGORIES_FLAGS:
+        await proceed_fallback(update, dialog_state)
+        return
 
-        if 'вещь' in message.lower():
-            await update_dialog_state(update, 'confirm_suspect_object')
-            return
+    update_user_context(update, 'selected_category', message)
 
-        await update_dialog_state(update, 'select_street')
+    if CATEGORIES_FLAGS[message]['suspect_object']:
+        await update_dialog_state(update, 'confirm_suspect_object')
         return
 
-    # user selected street -> validate street -> ask to type house number
-    if dialog_state == 'select_street':
-        if not message or message not in CONFIG['keyphrases']['supported_streets']:
-            await proceed_fallback(update, dialog_state)
-            return
+    await update_dialog_state(update, 'select_street')
+
 
-        update_user_context(update, 'selected_street', message)
-        await update_dialog_state(update, 'select_house_number')
+# user selected street -> validate street -> ask to type house number
+async def proceed_select_street_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not message or message not in CONFIG['keyphrases']['supported_streets']:
+        await proceed_fallback(update, dialog_state)
         return
 
-    # user typed house number -> validate number ->
-    #    - if "пожар" in selected_category -> ask section, details
-    #    - otherwise ask to select problem area, etc.
-    if dialog_state == 'select_house_number':
-        if not message:
-            await proceed_fallback(update, dialog_state)
-            return
+    update_user_context(update, 'selected_street', message)
+    await update_dialog_state(update, 'select_house_number')
+
 
-        message = message.lower().replace(' ', '')
+# user typed house number -> validate number ->
+#    - if category has its own route (e.g. fire alarm) -> follow it
+#    - otherwise ask to select problem area
+async def proceed_select_house_number_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not message:
+        await proceed_fallback(update, dialog_state)
+        return
 
+    message = get_house_key(message)
+
+    houses = ADDRESS_INDEX.get(get_user_context(update).get('selected_street'))
+    if houses is not None:
+        if message not in houses:
+            await proceed_fallback(update, dialog_state)
+            return
+    else:
         if len(message.split('к')) != 2 and not message.isnumeric():
             await proceed_fallback(update, dialog_state)
             return
@@ -819,293 +2493,956 @@ async def proceed_user_message(update: Update, _) -> None:
             await proceed_fallback(update, dialog_state)
             return
 
-        update_user_context(update, 'selected_house', message)
+    update_user_context(update, 'selected_house', message)
 
-        if 'пожар' in get_user_context(update).get('selected_category').lower():
-            await update_dialog_state(update, 'select_section_number')
-        else:
-            await update_dialog_state(update, 'select_problem_area')
+    category_route = CATEGORIES_ROUTES.get(get_user_context(update).get('selected_category'))
+    if category_route:
+        await update_dialog_state(update, category_route[0])
+    else:
+        await update_dialog_state(update, 'select_problem_area')
+
+
+# user selected problem area -> validate problem area -> follow the problem area route
+async def proceed_select_problem_area_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if update.effective_message.location is not None:
+        update_user_context(update, 'selected_problem_area', LOCATION_PROBLEM_AREA)
+        update_user_context(update, 'location_latitude', update.effective_message.location.latitude)
+        update_user_context(update, 'location_longitude', update.effective_message.location.longitude)
+        await update_dialog_state(update, PROBLEM_AREAS_ROUTES[LOCATION_PROBLEM_AREA][0])
         return
 
-    # user selected problem area -> validate problem area ->
-    #    - if user selected "на этаже" -> ask section, floor, confirm
-    #    - if user selected "у квартиры" -> ask section, floor, flat, confirm
-    #    - if user selected "на паркинге" -> ask parking number, confirm
-    #    - if user selected "в кладовках" -> ask storeroom number, confirm
-    #    - if user selected "во внутреннем дворе" -> ask details
-    #    - if user selected "на улице у дома" -> ask details
-    if dialog_state == 'select_problem_area':
-        if update.effective_message.location is not None:
-            update_user_context(update, 'selected_problem_area', 'место на карте')
-            update_user_context(update, 'location_latitude', update.effective_message.location.latitude)
-            update_user_context(update, 'location_longitude', update.effective_message.location.longitude)
-            await update_dialog_state(update, 'specify_description')
-            return
+    if not message or message not in CONFIG['keyphrases']['problem_areas']:
+        await proceed_fallback(update, dialog_state)
+        return
 
-        if not message or message not in CONFIG['keyphrases']['problem_areas']:
-            await proceed_fallback(update, dialog_state)
-            return
+    # remove future context data to avoid context spoofing and mixing types of selected places
+    delete_from_user_context(update, 'selected_details')
+    delete_from_user_context(update, 'selected_floor')
+    delete_from_user_context(update, 'selected_flat')
+    delete_from_user_context(update, 'selected_section')
+    delete_from_user_context(update, 'selected_parking')
+    delete_from_user_context(update, 'selected_storeroom')
+    delete_from_user_context(update, 'file_type')
+    delete_from_user_context(update, 'file_id')
+    delete_from_user_context(update, 'file_unique_id')
+    delete_from_user_context(update, 'file_size')
+    delete_from_user_context(update, 'file_height')
+    delete_from_user_context(update, 'file_width')
+    delete_from_user_context(update, 'file_duration')
+    delete_from_user_context(update, 'location_latitude')
+    delete_from_user_context(update, 'location_longitude')
 
-        # remove future context data to avoid context spoofing and mixing types of selected places
-        delete_from_user_context(update, 'selected_details')
-        delete_from_user_context(update, 'selected_floor')
-        delete_from_user_context(update, 'selected_flat')
-        delete_from_user_context(update, 'selected_section')
-        delete_from_user_context(update, 'selected_parking')
-        delete_from_user_context(update, 'selected_storeroom')
-        delete_from_user_context(update, 'file_type')
-        delete_from_user_context(update, 'file_id')
-        delete_from_user_context(update, 'file_unique_id')
-        delete_from_user_context(update, 'file_size')
-        delete_from_user_context(update, 'file_height')
-        delete_from_user_context(update, 'file_width')
-        delete_from_user_context(update, 'file_duration')
-        delete_from_user_context(update, 'location_latitude')
-        delete_from_user_context(update, 'location_longitude')
-
-        message = message.lower()
-        update_user_context(update, 'selected_problem_area', message)
-
-        if 'этаж' in message:
-            await update_dialog_state(update, 'select_section_number')
-        elif 'квартир' in message:
-            await update_dialog_state(update, 'select_section_number')
-        elif 'парк' in message:
-            await update_dialog_state(update, 'select_parking_number')
-        elif 'кладовк' in message:
-            await update_dialog_state(update, 'select_section_number')
-        elif 'двор' in message:
-            await update_dialog_state(update, 'specify_description')
-        elif 'улиц' in message:
-            await update_dialog_state(update, 'specify_description')
+    message = message.lower()
+    update_user_context(update, 'selected_problem_area', message)
+    await update_dialog_state(update, PROBLEM_AREAS_ROUTES[message][0])
 
-        return
 
-    # user specified section number -> validate section number ->
-    #    - if "пожар" in selected_category -> confirm
-    #    - otherwise ask floor, etc.
-    if dialog_state == 'select_section_number':
-        if not message or not message.isnumeric():
-            await proceed_fallback(update, dialog_state)
-            return
+# user specified section, floor, flat, parking or storeroom number -> validate number -> next state of the route
+async def proceed_number_state(update: Update, message: str or None, dialog_state: str) -> None:
+    context_key = NUMBER_DIALOG_STATES[dialog_state][0]
+    min_value, max_value = get_number_bounds(get_user_context(update), dialog_state)
 
-        section_number = int(message)
-        if section_number < 1 or section_number > 19:
-            await proceed_fallback(update, dialog_state)
-            return
+    if not message or not message.isnumeric():
+        await proceed_fallback(update, dialog_state)
+        return
 
-        update_user_context(update, 'selected_section', section_number)
+    number = int(message)
+    if number < min_value or number > max_value:
+        await proceed_fallback(update, dialog_state)
+        return
+
+    update_user_context(update, context_key, number)
+    await update_dialog_state(update, get_next_dialog_state(update, dialog_state))
 
-        if 'пожар' in get_user_context(update).get('selected_category').lower():
-            await update_dialog_state(update, 'confirm')
-        elif 'клад' in get_user_context(update).get('selected_problem_area').lower():
-            await update_dialog_state(update, 'select_storeroom_number')
-        else:
-            await update_dialog_state(update, 'select_floor_number')
 
+# user specified description -> confirm ->
+#    -> upload photo & send request
+#    -> send request
+async def proceed_specify_description_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not message:
+        await proceed_fallback(update, dialog_state)
         return
 
-    # user specified floor number -> validate floor number ->
-    #    - if user selected "у квартиры" -> ask flat, details
-    #    - otherwise details
-    if dialog_state == 'select_floor_number':
-        if not message or not message.isnumeric():
-            await proceed_fallback(update, dialog_state)
-            return
+    message = sanitize_description(message)
 
-        floor_number = int(message)
-        if floor_number < -1 or floor_number > 30:
-            await proceed_fallback(update, dialog_state)
-            return
+    # in case when message was full of bad symbols and now it is empty
+    if message == '':
+        await proceed_fallback(update, dialog_state)
+        return
 
-        update_user_context(update, 'selected_floor', floor_number)
-        if 'этаж' in get_user_context(update).get('selected_problem_area').lower():
-            await update_dialog_state(update, 'confirm')
-        else:
-            await update_dialog_state(update, 'select_flat_number')
+    if await bad_words_found(message):
+        await proceed_bad_words_fallback(update, dialog_state)
         return
 
-    # user specified flat number -> validate flat number -> confirm
-    if dialog_state == 'select_flat_number':
-        if not message or not message.isnumeric():
-            await proceed_fallback(update, dialog_state)
-            return
+    update_user_context(update, 'selected_details', message[:500])
+    await update_dialog_state(update, get_next_dialog_state(update, dialog_state))
 
-        flat_number = int(message)
-        if flat_number < 1 or flat_number > 2000:
-            await proceed_fallback(update, dialog_state)
-            return
 
-        update_user_context(update, 'selected_flat', flat_number)
-        await update_dialog_state(update, 'confirm')
+# user confirmed or clicked photo upload
+async def proceed_confirm_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not message:
+        await proceed_fallback(update, dialog_state)
         return
 
-    # user specified parking number -> validate parking number -> confirm
-    if dialog_state == 'select_parking_number':
-        if not message or not message.isnumeric():
-            await proceed_fallback(update, dialog_state)
-            return
+    if "фото" in message.lower():
+        await update_dialog_state(update, 'upload_photo')
+        return
 
-        parking_number = int(message)
-        if parking_number < 1 or parking_number > 1000:
-            await proceed_fallback(update, dialog_state)
+    if "опис" in message.lower():
+        await update_dialog_state(update, 'specify_description')
+        return
+
+    if is_go_confirm_message(message):
+
+        if await validate_request_already_exists(update):
             return
 
-        update_user_context(update, 'selected_parking', parking_number)
-        await update_dialog_state(update, 'confirm')
+        try:
+            await publish_request(update)
+        except TelegramError:
+            logging.exception('Request of %s is not published yet, it stays in outbox', update.effective_chat.id)
+            await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                                chat_id=update.effective_chat.id,
+                                text=CONFIG['messages_templates'].get('request_queued',
+                                                                      'Заявка принята и будет опубликована, '
+                                                                      'как только Telegram станет доступен'))
+        finally:
+            await go_restart(update)
+
+
+async def proceed_upload_photo_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not update.effective_message.effective_attachment:
+        await proceed_fallback(update, dialog_state)
         return
 
-    # user specified storeroom number -> validate storeroom number -> confirm
-    if dialog_state == 'select_storeroom_number':
-        if not message or not message.isnumeric():
-            await proceed_fallback(update, dialog_state)
-            return
+    if isinstance(update.effective_message.effective_attachment, tuple):
+        attachment = update.effective_message.effective_attachment[-1]
+    else:
+        attachment = update.effective_message.effective_attachment
+
+    if isinstance(attachment, PhotoSize):
+        attachment_type = 'photo'
+    elif isinstance(attachment, Animation):
+        attachment_type = 'gif'
+    elif isinstance(attachment, Video):
+        attachment_type = 'video'
+    else:
+        await proceed_fallback(update, dialog_state)
+        return
+
+    update_user_context(update, 'file_type', attachment_type)
+    update_user_context(update, 'file_id', attachment.file_id)
+    update_user_context(update, 'file_unique_id', attachment.file_unique_id)
+    update_user_context(update, 'file_size', attachment.file_size)
+    update_user_context(update, 'file_height', attachment.height)
+    update_user_context(update, 'file_width', attachment.width)
+
+    if attachment_type in ['gif', 'video']:
+        update_user_context(update, 'file_duration', attachment.duration)
+
+    await update_dialog_state(update, 'confirm')
 
-        storeroom_number = int(message)
-        if storeroom_number < 1 or storeroom_number > 1000:
-            await proceed_fallback(update, dialog_state)
-            return
 
-        update_user_context(update, 'selected_storeroom', storeroom_number)
-        await update_dialog_state(update, 'confirm')
+# user answered on suspected object confirmation
+async def proceed_confirm_suspect_object_state(update: Update, message: str or None, dialog_state: str) -> None:
+    if not message or message.lower() not in ['да', 'нет']:
+        await proceed_fallback(update, dialog_state)
+        return
+    if message.lower() == 'нет':
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            text=CONFIG['messages_templates']['found_object_redirect'],
+                            chat_id=update.effective_chat.id,
+                            reply_markup=KEYBOARDS['initial'])
+        await go_restart(update)
         return
 
-    # user specified description -> confirm ->
-    #    -> upload photo & send request
-    #    -> send request
-    if dialog_state == 'specify_description':
-        if not message:
-            await proceed_fallback(update, dialog_state)
-            return
+    await update_dialog_state(update, 'select_street')
 
-        # remove any links, emails and etc
-        message = clean(message,
-                        fix_unicode=True,
-                        to_ascii=False,
-                        lower=False,
-                        no_line_breaks=False,
-                        no_urls=True,
-                        no_emails=True,
-                        no_phone_numbers=True,
-                        replace_with_url="",
-                        replace_with_email="",
-                        replace_with_phone_number="",
-                        lang="ru")
-
-        # remove newlines with beautiful sentence ending
-        message = message.replace(",\n", ", ").replace("!\n", "! ").replace(":\n", ": ").replace("\n", ". ").replace(".. ", ". ").replace("  ", " ").replace(" . ", ". ")
-
-        # remove special chars
-        message = re.sub(r"[^a-zA-Zа-яА-Я0-9 ,.:;\-()!?\"]", "", message)
-
-        # remove urls if they still exists
-        message = re.sub(r"[0-9a-zA-Z\-]*(\.com|\.ru|\.org|\.su|\.net|\.рф|\.cc|\.ly|\.at|\.io)", "", message)
-
-        # in case when message was full of bad symbols and now it is empty
-        if message == '':
-            await proceed_fallback(update, dialog_state)
-            return
 
-        if await bad_words_found(message):
-            await proceed_bad_words_fallback(update, dialog_state)
-            return
+DIALOG_HANDLERS.update({
+    'start': proceed_start_state,
+    'select_street': proceed_select_street_state,
+    'select_house_number': proceed_select_house_number_state,
+    'select_problem_area': proceed_select_problem_area_state,
+    'specify_description': proceed_specify_description_state,
+    'confirm': proceed_confirm_state,
+    'upload_photo': proceed_upload_photo_state,
+    'confirm_suspect_object': proceed_confirm_suspect_object_state
+})
+DIALOG_HANDLERS.update({state: proceed_number_state for state in NUMBER_DIALOG_STATES})
+
+
+async def is_user_banned(update: Update) -> bool:
+    user_id = update.effective_user.id
+    cached_status = BAN_CACHE.get(user_id)
+
+    if cached_status is not None:
+        is_banned, expires_at = cached_status
+        if time.monotonic() < expires_at:
+            increment_metric('ban_cache_hits')
+            return is_banned
+
+        if CONFIG.get('ban_check', {}).get('background_refresh', True):
+            # answer with the last known status, the fresh one will be used for next messages
+            increment_metric('ban_cache_stale_hits')
+            if user_id not in BAN_CACHE_REFRESHING:
+                BAN_CACHE_REFRESHING.add(user_id)
+                run_in_background(refresh_user_ban_status(user_id))
+            return is_banned
+
+    increment_metric('ban_cache_misses')
+    return await refresh_user_ban_status(user_id)
+
+
+async def refresh_user_ban_status(user_id: int) -> bool:
+    started = time.monotonic()
+    try:
+        chat_member = await BOT.get_chat_member(CONFIG['groups']['main']['id'], user_id)
+    finally:
+        BAN_CACHE_REFRESHING.discard(user_id)
+        increment_metric('ban_check_requests')
+        increment_metric('ban_check_requests_ms', (time.monotonic() - started) * 1000)
+
+    is_banned = chat_member.status == chat_member.BANNED
+    cache_user_ban_status(user_id, is_banned)
+    return is_banned
+
+
+def cache_user_ban_status(user_id: int, is_banned: bool) -> None:
+    ban_check_config = CONFIG.get('ban_check', {})
+    if is_banned:
+        ttl = ban_check_config.get('ttl', 3600)
+    else:
+        ttl = ban_check_config.get('negative_ttl', 300)
+
+    if len(BAN_CACHE) >= BAN_CACHE_MAX_SIZE:
+        now = time.monotonic()
+        for cached_user_id in [key for key, value in BAN_CACHE.items() if value[1] < now]:
+            del BAN_CACHE[cached_user_id]
+
+    BAN_CACHE[user_id] = (is_banned, time.monotonic() + ttl)
 
-        update_user_context(update, 'selected_details', message[:500])
-        await update_dialog_state(update, 'confirm')
+
+async def proceed_main_group_chat_member(update: Update, _) -> None:
+    if update.chat_member.chat.id != CONFIG['groups']['main']['id']:
         return
 
-    # user confirmed or clicked photo upload
-    if dialog_state == 'confirm':
-        if not message:
-            await proceed_fallback(update, dialog_state)
-            return
+    new_chat_member = update.chat_member.new_chat_member
+    cache_user_ban_status(new_chat_member.user.id, new_chat_member.status == new_chat_member.BANNED)
+    increment_metric('ban_cache_invalidations')
 
-        if "фото" in message.lower():
-            await update_dialog_state(update, 'upload_photo')
-            return
 
-        if "опис" in message.lower():
-            await update_dialog_state(update, 'specify_description')
-            return
+async def show_metrics(update: Update, _):
+    # ignore any messages from non-personal dialogs
+    if update.effective_chat.type != 'private':
+        return
 
-        if is_go_confirm_message(message):
+    # if not enough rights - ignore command
+    if update.effective_user.id not in CONFIG['superusers']:
+        return
 
-            if await validate_request_already_exists(update):
-                return
+    metrics = dict(METRICS)
+    metrics['ban_cache_size'] = len(BAN_CACHE)
+    if metrics.get('ban_check_requests'):
+        # each cache hit saves one get_chat_member round-trip
+        average_request_ms = metrics['ban_check_requests_ms'] / metrics['ban_check_requests']
+        metrics['ban_cache_saved_ms'] = average_request_ms * (metrics.get('ban_cache_hits', 0) +
+                                                              metrics.get('ban_cache_stale_hits', 0))
 
-            messages_ids = await send_request_to_main_group(update)
-            update_user_requests_history(update, messages_ids)
-            await send_success_message_for_user(update, messages_ids[0])
-            await go_restart(update)
-            return
+    message = '\n'.join(f'{name}: {round(value, 2)}' for name, value in sorted(metrics.items()))
+
+    await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                        chat_id=update.effective_chat.id, text=message)
 
-    if dialog_state == 'upload_photo':
-        if not update.effective_message.effective_attachment:
-            await proceed_fallback(update, dialog_state)
-            return
 
-        if isinstance(update.effective_message.effective_attachment, tuple):
-            attachment = update.effective_message.effective_attachment[-1]
+def parse_requests_stats_arguments(args: List[str]) -> Tuple[str, str or None, Dict[str, str]]:
+    dates = []
+    filters = {}
+
+    for arg in args:
+        if '=' in arg:
+            field, value = arg.split('=', 1)
+            field = field.lower()
+            if field not in REQUESTS_STATS_FIELDS:
+                raise ValueError('Unknown stats filter', field)
+            filters[field] = normalize_requests_index_value(value)
         else:
-            attachment = update.effective_message.effective_attachment
-
-        if isinstance(attachment, PhotoSize):
-            attachment_type = 'photo'
-        elif isinstance(attachment, Animation):
-            attachment_type = 'gif'
-        elif isinstance(attachment, Video):
-            attachment_type = 'video'
+            dates.append(datetime.date.fromisoformat(arg).isoformat())
+
+    if len(dates) > 2:
+        raise ValueError('Too many dates', dates)
+
+    # current month by default
+    date_from = dates[0] if dates else get_current_time().date().replace(day=1).isoformat()
+    date_to = dates[1] if len(dates) > 1 else None
+
+    return date_from, date_to, filters
+
+
+def get_natural_sort_key(item: Tuple[str, int]) -> Tuple[int, str]:
+    return len(item[0]), item[0]
+
+
+def format_requests_stats(title: str, counts: List[Tuple[str, int]]) -> str:
+    return title + '\n' + '\n'.join(f'  {name}: {count}' for name, count in counts)
+
+
+def split_message_text(text: str) -> List[str]:
+    # by lines, so every part fits into one Telegram message
+    parts = ['']
+    for line in text.split('\n'):
+        while len(line) > MessageLimit.MAX_TEXT_LENGTH:
+            parts.append(line[:MessageLimit.MAX_TEXT_LENGTH])
+            line = line[MessageLimit.MAX_TEXT_LENGTH:]
+        if parts[-1] and len(parts[-1]) + 1 + len(line) > MessageLimit.MAX_TEXT_LENGTH:
+            parts.append(line)
         else:
-            await proceed_fallback(update, dialog_state)
-            return
+            parts[-1] = parts[-1] + '\n' + line if parts[-1] else line
+    return [part for part in parts if part.strip()]
 
-        update_user_context(update, 'file_type', attachment_type)
-        update_user_context(update, 'file_id', attachment.file_id)
-        update_user_context(update, 'file_unique_id', attachment.file_unique_id)
-        update_user_context(update, 'file_size', attachment.file_size)
-        update_user_context(update, 'file_height', attachment.height)
-        update_user_context(update, 'file_width', attachment.width)
 
-        if attachment_type in ['gif', 'video']:
-            update_user_context(update, 'file_duration', attachment.duration)
+async def show_requests_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # ignore any messages from non-personal dialogs
+    if update.effective_chat.type != 'private':
+        return
 
-        await update_dialog_state(update, 'confirm')
+    # if not enough rights - ignore command
+    if update.effective_user.id not in CONFIG['superusers']:
         return
 
-    # user answered on suspected object confirmation
-    if dialog_state == 'confirm_suspect_object':
-        if not message or message.lower() not in ['да', 'нет']:
-            await proceed_fallback(update, dialog_state)
-            return
-        if message.lower() == 'нет':
-            keyboard = form_initial_keyboard()
-            await BOT.send_message(text=CONFIG['messages_templates']['found_object_redirect'],
-                                   chat_id=update.effective_chat.id,
-                                   reply_markup=keyboard)
-            await go_restart(update)
-            return
+    try:
+        date_from, date_to, filters = parse_requests_stats_arguments(context.args or [])
+    except ValueError:
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message',
+                            chat_id=update.effective_chat.id,
+                            text='Формат: /stats [дата с] [дата по] [category=...] [house=...] [section=...]\n'
+                                 'Даты в формате 2024-01-31, по умолчанию - текущий месяц')
+        return
+
+    total = 0
+    by_category = Counter()
+    by_house = Counter()
+    by_section = Counter()
+    by_hour = Counter()
+    by_day = Counter()
+    first_day = bisect.bisect_left(REQUESTS_STATS_DAYS, date_from)
+    last_day = len(REQUESTS_STATS_DAYS) if date_to is None else bisect.bisect_right(REQUESTS_STATS_DAYS, date_to)
+    for day in REQUESTS_STATS_DAYS[first_day:last_day]:
+        for (hour, category, house, section), count in REQUESTS_STATS_BY_DAY[day].items():
+            if 'category' in filters and filters['category'] not in normalize_requests_index_value(category or ''):
+                continue
+            if 'house' in filters and filters['house'] != normalize_requests_index_value(house):
+                continue
+            if 'section' in filters and filters['section'] != normalize_requests_index_value(section):
+                continue
+
+            total += count
+            by_category[category or '-'] += count
+            by_house[str(house or '-')] += count
+            by_section[str(section or '-')] += count
+            by_hour[f'{hour:02}'] += count
+            by_day[day] += count
+
+    message = f'Заявок с {date_from} по {date_to or get_current_time().date().isoformat()}: {total}'
+    if total:
+        message += '\n\n' + '\n\n'.join([
+            format_requests_stats('По категориям:', by_category.most_common()),
+            format_requests_stats('По домам:', sorted(by_house.items(), key=get_natural_sort_key)),
+            format_requests_stats('По секциям:', sorted(by_section.items(), key=get_natural_sort_key)),
+            format_requests_stats('По часам:', sorted(by_hour.items())),
+            format_requests_stats('По дням:', sorted(by_day.items()))
+        ])
+
+    for part in split_message_text(message):
+        await OUTBOUND.send(SEND_PRIORITY_USER, 'send_message', chat_id=update.effective_chat.id, text=part)
+
+
+def save_context():
+    entries = collect_context_entries()
+    if entries:
+        save_context_entries(entries)
+
 
-        await update_dialog_state(update, 'select_street')
+async def save_context_async():
+    entries = collect_context_entries()
+    if not entries:
         return
 
+    # entries stay marked as unsaved until they are written, so they are not evicted from memory before that
+    keys = [(section, key) for section, key, _ in entries]
+    UNSAVED_CONTEXT_ENTRIES.update(keys)
+    try:
+        await run_io(save_context_entries, entries)
+    finally:
+        UNSAVED_CONTEXT_ENTRIES.subtract(keys)
+        for key in keys:
+            if UNSAVED_CONTEXT_ENTRIES[key] <= 0:
+                del UNSAVED_CONTEXT_ENTRIES[key]
 
-async def is_user_banned(update: Update):
-    chat_member = await BOT.get_chat_member(CONFIG['groups']['main']['id'], update.effective_user.id)
-    return chat_member.status == chat_member.BANNED
 
+def collect_context_entries() -> List[Tuple[str, Any, Any]]:
+    # only changed entries are written, so save cost depends on the amount of changes, not on users count;
+    # values are copied to be serialized outside of the event loop
+    entries = []
+    while DIRTY_CONTEXT_ENTRIES:
+        section, key = DIRTY_CONTEXT_ENTRIES.pop()
+        entries.append((section, key, copy.deepcopy(get_context_entry(section, key))))
+    return entries
 
-def save_context():
-    global IS_CONTEXT_CHANGED
-    if IS_CONTEXT_CHANGED:
-        with open('context.yaml', 'w') as file:
-            IS_CONTEXT_CHANGED = False
-            yaml_safe_dump(CONTEXT, file, encoding='UTF-8', allow_unicode=True)
+
+def is_context_entry_unsaved(section: str, key: Any) -> bool:
+    return (section, key) in DIRTY_CONTEXT_ENTRIES or (section, key) in UNSAVED_CONTEXT_ENTRIES
+
+
+def save_context_entries(entries: List[Tuple[str, Any, Any]]):
+    with CONTEXT_SAVE_LOCK:
+        STORAGE.write_entries(entries)
+
+
+def encode_context_value(value: Any) -> Any:
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError('Unsupported context value type', value)
+
+
+def get_context_entry(section: str, key: Any) -> Any:
+    if section == 'users':
+        return STORAGE.get_user(key)
+    return CONTEXT.get(section, {}).get(key)
+
+
+def append_context_journal(entries: List[Tuple[str, Any, Any]]):
+    records = []
+    for section, key, value in entries:
+        records.append(json.dumps({
+            'section': section,
+            'key': key,
+            'value': value
+        }, ensure_ascii=False, separators=(',', ':'), default=encode_context_value) + '\n')
+
+    with open(CONTEXT_JOURNAL_FILENAME, 'a', encoding='UTF-8') as file:
+        file.writelines(records)
+        file.flush()
+        os.fsync(file.fileno())
+
+    if os.path.getsize(CONTEXT_JOURNAL_FILENAME) > CONTEXT_JOURNAL_COMPACTION_SIZE:
+        compact_context()
+
+
+def compact_context():
+    global CONTEXT_COMPACTION_THREAD
+    if CONTEXT_COMPACTION_THREAD is not None and CONTEXT_COMPACTION_THREAD.is_alive():
+        return
+
+    # new changes are appended to a fresh journal file, the rotated one is merged into the snapshot
+    # and stays on disk until the new snapshot is safely swapped in
+    if isfile(CONTEXT_JOURNAL_FILENAME + '.old'):
+        return
+    os.replace(CONTEXT_JOURNAL_FILENAME, CONTEXT_JOURNAL_FILENAME + '.old')
+
+    CONTEXT_COMPACTION_THREAD = Thread(target=compact_context_snapshot, daemon=True)
+    CONTEXT_COMPACTION_THREAD.start()
+
+
+def compact_context_snapshot():
+    # built from files only, live context is not touched outside of the event loop
+    write_context_snapshot(load_context([CONTEXT_JOURNAL_FILENAME + '.old']))
+
+
+def write_context_snapshot(snapshot: Dict):
+    write_context_yaml(snapshot, CONTEXT_FILENAME)
+    os.unlink(CONTEXT_JOURNAL_FILENAME + '.old')
+    logging.info('Context snapshot compacted')
+
+
+def write_context_yaml(context: Dict, filename: str):
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w', encoding='UTF-8') as file:
+        yaml_safe_dump(context, file, allow_unicode=True)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_filename, filename)
+
+
+def load_context(journal_filenames: List[str] = None) -> Dict:
+    if journal_filenames is None:
+        # journal left from interrupted compaction goes first, the current one is replayed over it
+        journal_filenames = [CONTEXT_JOURNAL_FILENAME + '.old', CONTEXT_JOURNAL_FILENAME]
+
+    context = {
+        'users': {}
+    }
+
+    if isfile(CONTEXT_FILENAME):
+        with open(CONTEXT_FILENAME, 'r', encoding='UTF-8') as file:
+            context = yaml_safe_load(file) or context
+
+    for journal_filename in journal_filenames:
+        if not isfile(journal_filename):
+            continue
+
+        with open(journal_filename, 'r', encoding='UTF-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last record could be truncated by crash during write
+                    logging.warning('Skipping broken context journal record in %s', journal_filename)
+                    continue
+
+                section = context.setdefault(record['section'], {})
+                if record['value'] is None:
+                    section.pop(record['key'], None)
+                else:
+                    section[record['key']] = record['value']
+
+    return context
+
+
+async def start_background_tasks(_: Application) -> None:
+    init_outbound_dispatcher()
+    # requests left unpublished by previous run
+    run_in_background(resume_outbox_requests())
+    run_in_background(monitor_loop_lag())
+
+
+async def flush_context_on_shutdown(_: Application) -> None:
+    for task in list(BACKGROUND_TASKS):
+        task.cancel()
+    OUTBOUND.close()
+
+    await REQUESTS_LOG.flush()
+    await run_io(REQUESTS_LOG.close)
+    IO_EXECUTOR.shutdown(wait=True)
+    save_context()
+    if CONTEXT_COMPACTION_THREAD is not None:
+        CONTEXT_COMPACTION_THREAD.join()
+    if CPU_EXECUTOR is not None:
+        CPU_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    logging.info('Context saved')
+
+
+def recover_context_journal(context: Dict):
+    if isfile(CONTEXT_JOURNAL_FILENAME + '.old'):
+        # previous compaction was interrupted, finish it with already replayed state
+        write_context_snapshot(context)
+        if isfile(CONTEXT_JOURNAL_FILENAME):
+            os.unlink(CONTEXT_JOURNAL_FILENAME)
+
+    if isfile(CONTEXT_JOURNAL_FILENAME) and os.path.getsize(CONTEXT_JOURNAL_FILENAME) > 0:
+        # terminate possibly truncated last record so new records are not glued to it
+        with open(CONTEXT_JOURNAL_FILENAME, 'rb+') as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                file.write(b'\n')
+
+
+class YamlContextStorage:
+    # whole context lives in memory, context.yaml snapshot with the journal is the database
+
+    def load(self) -> Dict:
+        context = load_context()
+        recover_context_journal(context)
+        return context
+
+    def get_user(self, user_id: int) -> Dict or None:
+        return CONTEXT['users'].get(user_id)
+
+    def set_user(self, user_id: int, user_context: Dict) -> None:
+        CONTEXT['users'][user_id] = user_context
+
+    def iter_user_ids(self) -> List[int]:
+        return list(CONTEXT['users'].keys())
+
+    def iter_users(self) -> Iterable[Tuple[int, Dict]]:
+        return list(CONTEXT['users'].items())
+
+    def read_entry(self, section: str, key: Any) -> Any:
+        return CONTEXT.get(section, {}).get(key)
+
+    def write_entries(self, entries: List[Tuple[str, Any, Any]]) -> None:
+        append_context_journal(entries)
+
+    def export_yaml(self, filename: str, context: Dict) -> None:
+        write_context_yaml(context, filename)
+
+
+class SqliteContextStorage:
+    # users are stored one per row and only recently active ones are kept in memory,
+    # other context sections are small and loaded entirely
+
+    def __init__(self, path: str, cache_size: int):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # in WAL mode reads from the event loop are not blocked by writes from the I/O thread
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.write_lock = Lock()
+        self.write_connection = sqlite3.connect(path, check_same_thread=False)
+        self.write_connection.execute('PRAGMA journal_mode=WAL')
+        self.write_connection.execute('PRAGMA synchronous=NORMAL')
+        self.write_connection.execute('CREATE TABLE IF NOT EXISTS users ('
+                                      'user_id INTEGER PRIMARY KEY, '
+                                      'dialog_state TEXT, '
+                                      'last_request INTEGER, '
+                                      'bot_started INTEGER, '
+                                      'data TEXT NOT NULL)')
+        self.write_connection.execute('CREATE INDEX IF NOT EXISTS users_dialog_state ON users (dialog_state)')
+        self.write_connection.execute('CREATE INDEX IF NOT EXISTS users_last_request ON users (last_request)')
+        self.write_connection.execute('CREATE INDEX IF NOT EXISTS users_bot_started ON users (bot_started)')
+        self.write_connection.execute('CREATE TABLE IF NOT EXISTS context_entries ('
+                                      'section TEXT NOT NULL, '
+                                      'key TEXT NOT NULL, '
+                                      'value TEXT NOT NULL, '
+                                      'PRIMARY KEY (section, key))')
+        self.write_connection.commit()
+
+    def load(self) -> Dict:
+        with self.lock:
+            is_empty = self.connection.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0
+
+        if is_empty and (isfile(CONTEXT_FILENAME) or isfile(CONTEXT_JOURNAL_FILENAME)):
+            self.import_yaml()
+
+        context = {}
+        with self.lock:
+            for section, key, value in self.connection.execute('SELECT section, key, value FROM context_entries'):
+                context.setdefault(section, {})[json.loads(key)] = json.loads(value)
+        return context
+
+    def import_yaml(self) -> None:
+        context = load_context()
+        entries = [('users', user_id, user_context) for user_id, user_context in context.pop('users', {}).items()]
+        for section, values in context.items():
+            entries.extend((section, key, value) for key, value in values.items())
+        self.write_entries(entries)
+        logging.info('Context imported from %s into database, %s entries', CONTEXT_FILENAME, len(entries))
+
+    def get_user(self, user_id: int) -> Dict or None:
+        with self.lock:
+            user_context = self.cache.get(user_id)
+            if user_context is not None:
+                self.cache.move_to_end(user_id)
+                return user_context
+
+            row = self.connection.execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+
+            user_context = json.loads(row[0])
+            self.put_to_cache(user_id, user_context)
+            return user_context
+
+    def set_user(self, user_id: int, user_context: Dict) -> None:
+        with self.lock:
+            self.put_to_cache(user_id, user_context)
+
+    def put_to_cache(self, user_id: int, user_context: Dict) -> None:
+        self.cache[user_id] = user_context
+        self.cache.move_to_end(user_id)
+
+        # not yet saved users stay in memory until the next save_context
+        for cached_user_id in list(self.cache.keys()):
+            if len(self.cache) <= self.cache_size:
+                break
+            if cached_user_id != user_id and not is_context_entry_unsaved('users', cached_user_id):
+                del self.cache[cached_user_id]
+
+    def iter_user_ids(self) -> List[int]:
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT user_id FROM users')]
+
+    def iter_users(self) -> Iterable[Tuple[int, Dict]]:
+        for user_id in self.iter_user_ids():
+            user_context = self.get_user(user_id)
+            if user_context is not None:
+                yield user_id, user_context
+
+    def read_entry(self, section: str, key: Any) -> Any:
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM context_entries WHERE section = ? AND key = ?',
+                                          (section, json.dumps(key))).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def write_entries(self, entries: List[Tuple[str, Any, Any]]) -> None:
+        with self.write_lock, self.write_connection:
+            for section, key, value in entries:
+                if section == 'users' and value is None:
+                    self.write_connection.execute('DELETE FROM users WHERE user_id = ?', (key,))
+                elif section == 'users':
+                    self.write_connection.execute('INSERT OR REPLACE INTO users '
+                                                  '(user_id, dialog_state, last_request, bot_started, data) '
+                                                  'VALUES (?, ?, ?, ?, ?)',
+                                                  (key,
+                                                   value.get('dialog_state'),
+                                                   value.get('last_request'),
+                                                   value.get('bot_started'),
+                                                   json.dumps(value, ensure_ascii=False, separators=(',', ':'),
+                                                              default=encode_context_value)))
+                elif value is None:
+                    self.write_connection.execute('DELETE FROM context_entries WHERE section = ? AND key = ?',
+                                                  (section, json.dumps(key)))
+                else:
+                    self.write_connection.execute('INSERT OR REPLACE INTO context_entries (section, key, value) '
+                                                  'VALUES (?, ?, ?)',
+                                                  (section,
+                                                   json.dumps(key),
+                                                   json.dumps(value, ensure_ascii=False, separators=(',', ':'),
+                                                              default=encode_context_value)))
+
+    def export_yaml(self, filename: str, context: Dict) -> None:
+        context['users'] = {}
+        with self.write_lock:
+            for user_id, data in self.write_connection.execute('SELECT user_id, data FROM users'):
+                context['users'][user_id] = json.loads(data)
+        write_context_yaml(context, filename)
+
+
+def init_data_directory() -> None:
+    # all files changed by the bot are kept in one directory, so a container mounts it as one volume,
+    # files are replaced by renaming within it, which is not possible for a file mounted alone
+    global DATA_DIRECTORY, CONTEXT_FILENAME, CONTEXT_JOURNAL_FILENAME
+    DATA_DIRECTORY = CONFIG.get('data_directory', '.')
+    os.makedirs(DATA_DIRECTORY, exist_ok=True)
+    CONTEXT_FILENAME = os.path.join(DATA_DIRECTORY, 'context.yaml')
+    CONTEXT_JOURNAL_FILENAME = os.path.join(DATA_DIRECTORY, 'context.journal')
+
+
+def init_storage() -> YamlContextStorage or SqliteContextStorage:
+    storage_config = CONFIG.get('storage', {})
+    backend = storage_config.get('backend', 'yaml')
+
+    if backend == 'yaml':
+        return YamlContextStorage()
+
+    if backend == 'sqlite':
+        return SqliteContextStorage(os.path.join(DATA_DIRECTORY, storage_config.get('path', 'context.sqlite3')),
+                                    storage_config.get('cache_size', 1000))
+
+    raise ValueError('Unknown storage backend', backend)
+
+
+def get_recent_requests_timer_mins(category: str) -> float:
+    timer_mins = CONFIG.get('recent_requests_timer_mins', RECENT_REQUESTS_TIMER_MINS)
+    if isinstance(timer_mins, dict):
+        return timer_mins.get(category, timer_mins.get('default', RECENT_REQUESTS_TIMER_MINS))
+    return timer_mins
+
+
+async def add_recent_request(request_hash: str, message_id: int, author_id: int, category: str) -> None:
+    sent = get_current_timestamp()
+    expires = sent + round(get_recent_requests_timer_mins(category) * 60 * 1000)
+
+    request = CONTEXT['recent_requests'][request_hash] = {
+        'message_id': message_id,
+        'sent': sent,
+        'expires': expires,
+        'author_id': author_id
+    }
+    heapq.heappush(RECENT_REQUESTS_EXPIRATION, (expires, request_hash))
+
+    pending_request = RECENT_REQUESTS_PENDING.pop(request_hash, None)
+    if pending_request is not None and not pending_request.done():
+        pending_request.set_result(message_id)
+
+    # saved at once, so duplicates are detected right after restart and by other processes sharing the storage
+    await run_io(save_context_entries, [('recent_requests', request_hash, dict(request))])
+
+
+def find_recent_request(request_hash: str) -> Dict or None:
+    cleanup_recent_requests()
+
+    request = CONTEXT['recent_requests'].get(request_hash)
+    if request is not None:
+        return request
+
+    request = STORAGE.read_entry('recent_requests', request_hash)
+    if request is None or request['expires'] <= get_current_timestamp():
+        return None
+
+    # registered by another process
+    CONTEXT['recent_requests'][request_hash] = request
+    heapq.heappush(RECENT_REQUESTS_EXPIRATION, (request['expires'], request_hash))
+    return request
 
 
 def cleanup_recent_requests():
-    for i, request in enumerate(RECENT_REQUESTS):
-        if get_current_timestamp() - request['sent'] > RECENT_REQUESTS_TIMER_MINS * 60 * 1000:
-            del RECENT_REQUESTS[i]
+    now = get_current_timestamp()
+    while RECENT_REQUESTS_EXPIRATION and RECENT_REQUESTS_EXPIRATION[0][0] <= now:
+        expires, request_hash = heapq.heappop(RECENT_REQUESTS_EXPIRATION)
+        # the same request could be registered again later with the new expiration time
+        request = CONTEXT['recent_requests'].get(request_hash)
+        if request is not None and request['expires'] == expires:
+            del CONTEXT['recent_requests'][request_hash]
+            mark_context_changed('recent_requests', request_hash)
+
+
+def build_recent_requests_index() -> None:
+    CONTEXT.setdefault('recent_requests', {})
+    RECENT_REQUESTS_EXPIRATION.clear()
+    for request_hash, request in CONTEXT['recent_requests'].items():
+        RECENT_REQUESTS_EXPIRATION.append((request['expires'], request_hash))
+    heapq.heapify(RECENT_REQUESTS_EXPIRATION)
+    cleanup_recent_requests()
+
+
+def build_requests_stats_index() -> None:
+    REQUESTS_STATS_BY_DAY.clear()
+    REQUESTS_STATS_DAYS.clear()
+    if 'requests_stats' in CONTEXT:
+        for request_stats_key, count in CONTEXT['requests_stats'].items():
+            index_requests_stats(*json.loads(request_stats_key), count)
+        return
+
+    # context saved before stats existed - count requests already written into the log once
+    CONTEXT['requests_stats'] = {}
+    for segment in REQUESTS_LOG.segments:
+        if segment.first_timestamp() is None:
+            continue
+
+        requests = load_requests_cache_frame(segment.cache_path, None, None, None, CONFIG['timezone'])
+        requests = requests.astype({'category': object, 'house': object, 'section': object})
+        requests = requests.assign(day=requests['date'].dt.strftime('%Y-%m-%d'), hour=requests['date'].dt.hour)
+        grouped = requests.groupby(['day', 'hour', 'category', 'house', 'section'], dropna=False).size()
+        for (day, hour, category, house, section), count in grouped.items():
+            add_requests_stats({
+                'date': f'{day}T{hour:02}',
+                'category': None if pd.isna(category) else category,
+                'house': None if pd.isna(house) else house,
+                'section': None if pd.isna(section) else int(section)
+            }, int(count))
+
+    logging.info('Requests stats built for %s keys', len(CONTEXT['requests_stats']))
+
+
+class OfflineBotRequest(BaseRequest):
+    # answers bot API methods locally instead of Telegram, to test the bot by posting recorded updates to webhook
+
+    def __init__(self):
+        self.messages_count = 0
+
+    @property
+    def read_timeout(self) -> float or None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        logging.info('Offline bot API call %s %s', api_method, parameters)
+        payload = {'ok': True, 'result': self.get_result(api_method, parameters)}
+        return HTTPStatus.OK, json.dumps(payload).encode('UTF-8')
+
+    def get_result(self, api_method: str, parameters: Dict) -> Any:
+        if api_method == 'getMe':
+            return {
+                'id': CONFIG['bot_credentials']['id'],
+                'is_bot': True,
+                'first_name': CONFIG['bot_credentials']['username'],
+                'username': CONFIG['bot_credentials']['username']
+            }
+
+        if api_method == 'getChatMember':
+            return {
+                'status': 'member',
+                'user': {'id': int(parameters['user_id']), 'is_bot': False, 'first_name': 'user'}
+            }
+
+        if api_method.startswith('send') or api_method.startswith('edit'):
+            self.messages_count += 1
+            return {
+                'message_id': self.messages_count,
+                'date': int(time.time()),
+                'chat': {'id': int(parameters.get('chat_id', 0)), 'type': 'private'}
+            }
+
+        return True
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+
+    def initialize(self, telegram_application: Application, secret_token: str) -> None:
+        self.telegram_application = telegram_application
+        self.secret_token = secret_token
+
+    async def post(self) -> None:
+        received_secret_token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(received_secret_token, self.secret_token):
+            increment_metric('webhook_rejected_updates')
+            raise tornado.web.HTTPError(HTTPStatus.FORBIDDEN)
+
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.telegram_application.bot)
+        except (ValueError, TypeError, KeyError):
+            logging.warning('Webhook received malformed update')
+            raise tornado.web.HTTPError(HTTPStatus.BAD_REQUEST)
+
+        # updates are processed by the application in the same way as polled ones
+        await self.telegram_application.update_queue.put(update)
+        increment_metric('webhook_updates')
+
+
+class HealthCheckHandler(tornado.web.RequestHandler):
+
+    def initialize(self, telegram_application: Application) -> None:
+        self.telegram_application = telegram_application
+
+    def get(self) -> None:
+        if not self.telegram_application.running:
+            self.set_status(HTTPStatus.SERVICE_UNAVAILABLE)
+        self.write({
+            'running': self.telegram_application.running,
+            'updates_queue_size': self.telegram_application.update_queue.qsize()
+        })
+
+
+async def run_webhook(application: Application, webhook_config: Dict) -> None:
+    secret_token = webhook_config.get('secret_token')
+    if not secret_token:
+        raise ValueError('Webhook secret token is not configured')
+
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (webhook_config.get('path', '/telegram'), TelegramWebhookHandler,
+         {'telegram_application': application, 'secret_token': secret_token}),
+        (webhook_config.get('health_path', '/health'), HealthCheckHandler, {'telegram_application': application})
+    ]))
+
+    stop_event = asyncio.Event()
+    for signal_number in [signal.SIGINT, signal.SIGTERM]:
+        asyncio.get_running_loop().add_signal_handler(signal_number, stop_event.set)
+
+    # the same lifecycle as run_polling has, hooks are not called by the application itself
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    if webhook_config.get('url'):
+        # chat_member updates are not sent by Telegram unless requested explicitly
+        await application.bot.set_webhook(webhook_config['url'],
+                                          secret_token=secret_token,
+                                          allowed_updates=Update.ALL_TYPES)
+
+    server.listen(webhook_config.get('port', 8080), address=webhook_config.get('listen', '0.0.0.0'))
+    logging.info('Bot is ready, listening webhook on port %s...', webhook_config.get('port', 8080))
+
+    try:
+        await stop_event.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
 
 
 def main():
@@ -1116,23 +3453,44 @@ def main():
         global CONFIG
         CONFIG = yaml_safe_load(file)
 
-    profanity.add_censor_words(CONFIG['bad_words'])
+    build_bad_words_regex()
+    build_keyboards()
+    build_address_index()
+    build_dialog_tables()
+    build_keyphrases_regex()
 
     logging.info('Configuration loaded')
 
+    init_data_directory()
+
+    global STORAGE
+    STORAGE = init_storage()
+
     global CONTEXT
-    if not isfile('context.yaml'):
-        CONTEXT = {
-            'users': {}
-        }
-    else:
-        with open('context.yaml', 'r') as file:
-            CONTEXT = yaml_safe_load(file)
+    CONTEXT = STORAGE.load()
+    build_requests_subscribers_index()
+    build_recent_requests_index()
+    load_outbox()
 
     logging.info('Context loaded')
 
-    application: Application = ApplicationBuilder(). \
-        token(CONFIG['bot_credentials']['secret']).build()
+    application_builder = ApplicationBuilder(). \
+        token(CONFIG['bot_credentials']['secret']). \
+        post_init(start_background_tasks). \
+        post_shutdown(flush_context_on_shutdown)
+
+    webhook_config = CONFIG.get('webhook') or {}
+    if webhook_config.get('enabled'):
+        application_builder = application_builder.updater(None)
+    if webhook_config.get('enabled') and webhook_config.get('offline'):
+        application_builder = application_builder.request(OfflineBotRequest()). \
+            get_updates_request(OfflineBotRequest())
+
+    concurrent_updates = CONFIG.get('concurrent_updates', 1)
+    if concurrent_updates > 1:
+        application_builder = application_builder.concurrent_updates(UserOrderedUpdateProcessor(concurrent_updates))
+
+    application: Application = application_builder.build()
 
     # welcome message
     start_handler = CommandHandler('start', start)
@@ -1154,6 +3512,27 @@ def main():
     export_requests_database_handler = CommandHandler('export_requests_database', export_requests_database)
     application.add_handler(export_requests_database_handler)
 
+    # technical command - return request by its message id in main group
+    show_request_handler = CommandHandler('show_request', show_request)
+    application.add_handler(show_request_handler)
+
+    # technical command - return file with users context in import/export format
+    export_context_handler = CommandHandler('export_context', export_context)
+    application.add_handler(export_context_handler)
+
+    # technical command - return requests counters by categories, houses, sections, hours and days
+    show_requests_stats_handler = CommandHandler('stats', show_requests_stats)
+    application.add_handler(show_requests_stats_handler)
+
+    # technical command - return bot internal counters
+    show_metrics_handler = CommandHandler('metrics', show_metrics)
+    application.add_handler(show_metrics_handler)
+
+    # users joined, left or banned in main group - keep cached ban status actual
+    main_group_chat_member_handler = ChatMemberHandler(proceed_main_group_chat_member,
+                                                       ChatMemberHandler.CHAT_MEMBER)
+    application.add_handler(main_group_chat_member_handler)
+
     # any raw messages from users
     # TODO: add filter only private messages
     messages_handler = MessageHandler((filters.TEXT | filters.PHOTO | filters.VIDEO | filters.LOCATION | filters.ANIMATION) & (~filters.COMMAND), proceed_user_message)
@@ -1164,12 +3543,24 @@ def main():
     global BOT
     BOT = application.bot
 
-    set_interval(save_context, 10)
-    set_interval(cleanup_recent_requests, 30)
+    schedule_job(application, save_context_async, SAVE_CONTEXT_INTERVAL_SECS)
+    schedule_job(application, cleanup_recent_requests, CLEANUP_RECENT_REQUESTS_INTERVAL_SECS)
+    schedule_job(application, resume_outbox_requests, OUTBOX_RESUME_INTERVAL_SECS)
+
+    global REQUESTS_LOG
+    REQUESTS_LOG = init_requests_log()
+    build_requests_stats_index()
+    schedule_job(application, REQUESTS_LOG.flush, CONFIG.get('requests_log', {}).get('flush_interval_secs', 1),
+                 name='flush_requests_log')
+
+    if webhook_config.get('enabled'):
+        asyncio.run(run_webhook(application, webhook_config))
+        return
 
     logging.info('Bot is ready, polling...')
 
-    application.run_polling()
+    # chat_member updates are not sent by Telegram unless requested explicitly
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,85 @@
+# per message cost of description checks before and after precompiled sanitizer and bad words regexes:
+#   python tests/benchmark_description.py
+import asyncio
+import os
+import random
+import re
+import sys
+import time
+
+import yaml
+from better_profanity import Profanity
+from cleantext import clean
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from test_bad_words import generate_messages  # noqa: E402
+
+MESSAGES_COUNT = 2000
+
+
+def sanitize_description_before(message: str) -> str:
+    # inline code of specify_description handler before sanitize_description()
+    message = clean(message,
+                    fix_unicode=True,
+                    to_ascii=False,
+                    lower=False,
+                    no_line_breaks=False,
+                    no_urls=True,
+                    no_emails=True,
+                    no_phone_numbers=True,
+                    replace_with_url="",
+                    replace_with_email="",
+                    replace_with_phone_number="",
+                    lang="ru")
+    message = message.replace(",\n", ", ").replace("!\n", "! ").replace(":\n", ": ").replace("\n", ". ").replace(".. ", ". ").replace("  ", " ").replace(" . ", ". ")
+    message = re.sub(r"[^a-zA-Zа-яА-Я0-9 ,.:;\-()!?\"]", "", message)
+    return re.sub(r"[0-9a-zA-Z\-]*(\.com|\.ru|\.org|\.su|\.net|\.рф|\.cc|\.ly|\.at|\.io)", "", message)
+
+
+def generate_descriptions(profanity: Profanity) -> list:
+    extras = ['https://example.com/path?a=1', 'mail@example.ru', '+7 (999) 123-45-67', 'site.рф', ',\n', '!\n', '\n']
+    return [' '.join([message] + random.choices(extras, k=random.randint(0, 3)))
+            for message in generate_messages(profanity, MESSAGES_COUNT)]
+
+
+async def find_bad_words(messages: list) -> list:
+    return [await main.bad_words_found(message) for message in messages]
+
+
+def measure(name: str, function, messages: list, repeats: int = 3) -> list:
+    # the best of several runs of all messages
+    durations = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        results = function(messages)
+        durations.append(time.perf_counter() - started)
+    print('%s: %.1f us per message' % (name, min(durations) / len(messages) * 1e6))
+    return results
+
+
+def main_benchmark() -> None:
+    with open(os.path.join(os.path.dirname(main.__file__), 'config.example.yaml'), encoding='UTF-8') as file:
+        main.CONFIG = yaml.safe_load(file)
+    main.build_bad_words_regex()
+    profanity = Profanity()
+    profanity.add_censor_words(main.CONFIG['bad_words'])
+
+    random.seed(19)
+    descriptions = generate_descriptions(profanity)
+    before = measure('sanitizer before', lambda messages: [sanitize_description_before(message) for message in messages],
+                     descriptions)
+    after = measure('sanitizer after', lambda messages: [main.sanitize_description(message) for message in messages],
+                    descriptions)
+    assert before == after
+
+    before = measure('bad words before', lambda messages: [profanity.contains_profanity(message) for message in messages],
+                     after, 1)
+    after = measure('bad words after', lambda messages: asyncio.run(find_bad_words(messages)), after)
+    assert before == after
+    print('%d of %d messages have bad words' % (sum(after), len(after)))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+
+import pytest
+import yaml
+from telegram import Message
+from telegram.error import Forbidden, NetworkError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        # sends to these chats fail as if Telegram was not reachable
+        self.unavailable_chats = set()
+        # users who blocked the bot
+        self.blocked_chats = set()
+
+    async def send_message(self, **kwargs):
+        if kwargs['chat_id'] in self.unavailable_chats:
+            raise NetworkError('Telegram is not reachable')
+        if kwargs['chat_id'] in self.blocked_chats:
+            raise Forbidden('Forbidden: bot was blocked by the user')
+        self.sent.append(kwargs)
+        # publication takes a while, so concurrent updates overlap with it
+        await asyncio.sleep(0.05)
+        return Message.de_json({'message_id': len(self.sent), 'date': 0,
+                                'chat': {'id': kwargs['chat_id'], 'type': 'private'}}, None)
+
+
+async def flush_requests_log():
+    # scheduled job of the application
+    while True:
+        await asyncio.sleep(0.01)
+        try:
+            await main.REQUESTS_LOG.flush()
+        except OSError:
+            # failed batch is reported to its writers, the job keeps running
+            pass
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    # bot state of main() with example config, empty context and requests log in a temporary directory,
+    # every global is restored after the test
+    monkeypatch.chdir(tmp_path)
+    with open(os.path.join(os.path.dirname(main.__file__), 'config.example.yaml'), encoding='UTF-8') as file:
+        monkeypatch.setattr(main, 'CONFIG', yaml.safe_load(file), raising=False)
+    main.build_bad_words_regex()
+    main.build_keyboards()
+    main.build_address_index()
+    main.build_dialog_tables()
+    main.build_keyphrases_regex()
+    monkeypatch.setattr(main, 'STORAGE', main.YamlContextStorage(), raising=False)
+    monkeypatch.setattr(main, 'CONTEXT', {'users': {}, 'recent_requests': {}, 'requests_subscribers': {},
+                                          'requests_stats': {}, 'outbox': {}}, raising=False)
+    monkeypatch.setattr(main, 'DIRTY_CONTEXT_ENTRIES', set())
+    monkeypatch.setattr(main, 'RECENT_REQUESTS_EXPIRATION', [])
+    monkeypatch.setattr(main, 'RECENT_REQUESTS_PENDING', {})
+    monkeypatch.setattr(main, 'REQUESTS_STATS_BY_DAY', {})
+    monkeypatch.setattr(main, 'REQUESTS_STATS_DAYS', [])
+    monkeypatch.setattr(main, 'OUTBOX_IN_PROGRESS', set())
+    monkeypatch.setattr(main, 'BACKGROUND_TASKS', set())
+    monkeypatch.setattr(main, 'METRICS', {})
+    monkeypatch.setattr(main, 'OUTBOUND', None, raising=False)
+    requests_log = main.RequestsLogWriter(str(tmp_path / 'requests'), 'batch', 50, False)
+    requests_log.load()
+    monkeypatch.setattr(main, 'REQUESTS_LOG', requests_log, raising=False)
+    monkeypatch.setattr(main, 'BOT', FakeBot(), raising=False)
+    return main.BOT
+
+
+@pytest.fixture
+def start_bot_tasks(bot):
+    # started inside the event loop of the test
+    def start() -> None:
+        main.init_outbound_dispatcher()
+        main.run_in_background(flush_requests_log())
+
+    return start
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import random
+
+import pytest
+import yaml
+from better_profanity import Profanity
+
+import main
+
+
+@pytest.fixture
+def bad_words(monkeypatch):
+    # words of example config are censored in addition to the default ones, as the bot did before
+    with open(os.path.join(os.path.dirname(main.__file__), 'config.example.yaml'), encoding='UTF-8') as file:
+        monkeypatch.setattr(main, 'CONFIG', yaml.safe_load(file), raising=False)
+    main.build_bad_words_regex()
+    profanity = Profanity()
+    profanity.add_censor_words(main.CONFIG['bad_words'])
+    return profanity
+
+
+def generate_messages(profanity: Profanity, count: int) -> list:
+    words = [str(word) for word in profanity.CENSOR_WORDSET]
+    pieces = ['дом', 'подъезд', 'лифт', 'hello', 'a', 'x', 'I', '1'] + \
+             [word[:random.randint(1, len(word))] for word in words] + \
+             [word[random.randint(0, len(word) - 1):] for word in words] + random.sample(words, 50)
+    separators = [' ', '  ', ', ', '. ', '_', '-', '!', '\n', '"', "'", '*', '$', '@', '']
+
+    messages = []
+    for _ in range(count):
+        message = ''
+        for piece in random.choices(pieces, k=random.randint(1, 8)):
+            for char in piece:
+                chance = random.random()
+                if char in profanity.CHARS_MAPPING and chance < 0.3:
+                    char = random.choice(profanity.CHARS_MAPPING[char])
+                elif chance < 0.05:
+                    char += random.choice(separators)
+                elif chance < 0.08:
+                    char = char.upper()
+                message += char
+            message += random.choice(separators)
+        messages.append(message.rstrip() if random.random() < 0.5 else message)
+    return messages
+
+
+@pytest.mark.parametrize('message', ['sh!t', 'sh!t.', 'лох_1', 'Лох', 'f uck', 'f u c k', 'fuc k', 'fuc k.',
+                                     'hand job', 'hand-job', 'hand  job', 'x fu ck', 'fu*k', '"fuck"', 'a$$',
+                                     'жопа', 'жоп', 'разлохматить', 'ass_hole', 'class', 'f', ''])
+def test_same_verdict_as_better_profanity(bad_words, message):
+    assert asyncio.run(main.bad_words_found(message)) == bad_words.contains_profanity(message)
+
+
+def test_same_verdict_on_generated_messages(bad_words):
+    random.seed(19)
+    for message in generate_messages(bad_words, 300):
+        assert asyncio.run(main.bad_words_found(message)) == bad_words.contains_profanity(message), message
@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+from pathlib import Path
+
+import pytest
+from telegram.error import RetryAfter
+
+import main
+
+
+class FloodedBot:
+    # the first send of every document hits flood control
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        self.attempts = 0
+        self.uploaded = []
+
+    async def send_document(self, document, **kwargs):
+        # read the way telegram InputFile reads paths and file objects
+        content = document.read_bytes() if isinstance(document, Path) else document.read()
+        self.attempts += 1
+        if self.attempts == 1:
+            raise RetryAfter(datetime.timedelta(seconds=self.retry_after))
+        self.uploaded.append(content)
+        return self.attempts
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    monkeypatch.setattr(main, 'CONFIG', {}, raising=False)
+    monkeypatch.setattr(main, 'METRICS', {})
+    monkeypatch.setattr(main, 'BACKGROUND_TASKS', set())
+    monkeypatch.setattr(main, 'OUTBOUND', None, raising=False)
+
+
+def test_document_is_uploaded_again_after_flood_wait(dispatcher, monkeypatch, tmp_path):
+    bot = FloodedBot(0.01)
+    monkeypatch.setattr(main, 'BOT', bot, raising=False)
+    export_path = tmp_path / 'requests.csv'
+    export_path.write_bytes(b'message_id,date\n1,2024-03-01\n')
+
+    async def run():
+        main.init_outbound_dispatcher()
+        return await main.OUTBOUND.send(main.SEND_PRIORITY_USER, 'send_document', chat_id=1,
+                                        document=Path(export_path))
+
+    assert asyncio.run(run()) == 2
+    assert bot.uploaded == [export_path.read_bytes()]
+
+
+def test_deferred_send_is_cancelled_on_shutdown(dispatcher, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'BOT', FloodedBot(60), raising=False)
+    export_path = tmp_path / 'requests.csv'
+    export_path.write_bytes(b'message_id\n')
+
+    async def run():
+        main.init_outbound_dispatcher()
+        send = asyncio.create_task(main.OUTBOUND.send(main.SEND_PRIORITY_USER, 'send_document', chat_id=1,
+                                                      document=Path(export_path)))
+        while not main.OUTBOUND.deferred_entries:
+            await asyncio.sleep(0.01)
+
+        main.OUTBOUND.close()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(send, 1)
+        assert not main.OUTBOUND.deferred_entries
+
+    asyncio.run(run())
@@ -0,0 +1,168 @@
+import asyncio
+
+from telegram import Update
+
+import main
+
+MESSAGE_ID = 5
+
+
+def add_interrupted_request(written: bool) -> None:
+    # request published to main group, the process stopped before requests history step was saved
+    message_data = {'date': '2024-03-01T10:00:00+03:00', 'category': 'Пожарная сигнализация', 'house': '2',
+                    'section': 1, 'user': 7}
+    main.CONTEXT['outbox']['7:100'] = {
+        'created': 0,
+        'chat_id': 7,
+        'request_hash': 'hash',
+        'message': 'request',
+        'message_data': message_data,
+        'attachment_type': None,
+        'attachment': None,
+        'location': None,
+        'caption': False,
+        'steps_message_ids': {'message': MESSAGE_ID},
+        'done_steps': ['message', 'location', 'attachment', 'recent_request', 'user_history', 'success_message'],
+        'attempts': 0,
+        'next_attempt': 0
+    }
+    if written:
+        main.REQUESTS_LOG.write_records([(MESSAGE_ID, message_data)])
+        main.add_requests_stats(message_data)
+
+
+def resume_outbox_requests(start_bot_tasks) -> None:
+    async def run():
+        start_bot_tasks()
+        await main.resume_outbox_requests()
+
+    asyncio.run(run())
+
+
+def test_resumed_request_already_in_log_is_not_written_again(bot, start_bot_tasks):
+    add_interrupted_request(written=True)
+
+    resume_outbox_requests(start_bot_tasks)
+
+    assert main.REQUESTS_LOG.segments[-1].records == 1
+    assert list(main.CONTEXT['requests_stats'].values()) == [1]
+    assert not main.CONTEXT['outbox']
+    assert not bot.sent
+
+
+def test_resumed_request_missing_in_log_is_written_once(bot, start_bot_tasks):
+    add_interrupted_request(written=False)
+
+    resume_outbox_requests(start_bot_tasks)
+
+    assert main.REQUESTS_LOG.segments[-1].records == 1
+    assert main.REQUESTS_LOG.find(MESSAGE_ID)['user'] == 7
+    assert list(main.CONTEXT['requests_stats'].values()) == [1]
+    assert not main.CONTEXT['outbox']
+
+
+def test_failed_group_commit_is_counted_in_stats_once(bot, start_bot_tasks, monkeypatch):
+    add_interrupted_request(written=False)
+    write_records = main.REQUESTS_LOG.write_records
+
+    def fail_write_records(records):
+        monkeypatch.setattr(main.REQUESTS_LOG, 'write_records', write_records)
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(main.REQUESTS_LOG, 'write_records', fail_write_records)
+
+    resume_outbox_requests(start_bot_tasks)
+
+    assert main.CONTEXT['outbox']['7:100']['attempts'] == 1
+    assert not main.CONTEXT['requests_stats']
+
+    main.CONTEXT['outbox']['7:100']['next_attempt'] = 0
+    resume_outbox_requests(start_bot_tasks)
+
+    assert main.REQUESTS_LOG.segments[-1].records == 1
+    assert list(main.CONTEXT['requests_stats'].values()) == [1]
+    assert not main.CONTEXT['outbox']
+
+
+def test_request_failing_for_good_is_parked(bot, start_bot_tasks):
+    add_interrupted_request(written=False)
+    request = main.CONTEXT['outbox']['7:100']
+    request['done_steps'] = []
+    request['attempts'] = main.OUTBOX_MAX_ATTEMPTS - 1
+    bot.unavailable_chats.add(main.CONFIG['groups']['main']['id'])
+
+    resume_outbox_requests(start_bot_tasks)
+
+    assert not main.CONTEXT['outbox']
+    assert main.CONTEXT['outbox_parked']['7:100']['attempts'] == main.OUTBOX_MAX_ATTEMPTS
+    assert 'NetworkError' in main.CONTEXT['outbox_parked']['7:100']['error']
+    assert [message['chat_id'] for message in bot.sent] == main.CONFIG['superusers']
+    assert '7:100' in bot.sent[0]['text']
+
+
+def add_users_with_same_request(users_ids) -> None:
+    for user_id in users_ids:
+        main.CONTEXT['users'][user_id] = {'bot_started': 1, 'dialog_state': 'confirm',
+                                          'selected_category': 'Пожарная сигнализация',
+                                          'selected_street': 'улица Пушкина', 'selected_house': '2',
+                                          'selected_section': 1}
+
+
+async def confirm_request(user_id: int, message_id: int) -> None:
+    update = Update.de_json({'update_id': message_id,
+                             'message': {'message_id': message_id, 'date': 0, 'text': 'ok',
+                                         'chat': {'id': user_id, 'type': 'private'},
+                                         'from': {'id': user_id, 'is_bot': False, 'first_name': 'A'}}}, None)
+    await main.proceed_confirm_state(update, 'ok', 'confirm')
+
+
+def get_main_group_posts(bot) -> list:
+    return [message for message in bot.sent if message['chat_id'] == main.CONFIG['groups']['main']['id']]
+
+
+def test_same_request_confirmed_during_outage_is_published_once(bot, start_bot_tasks):
+    add_users_with_same_request([7, 8])
+    bot.unavailable_chats.add(main.CONFIG['groups']['main']['id'])
+
+    async def run():
+        start_bot_tasks()
+        await confirm_request(7, 100)
+        await confirm_request(8, 200)
+        assert list(main.CONTEXT['outbox']) == ['7:100']
+        assert main.CONTEXT['outbox']['7:100']['subscribers'] == [8]
+
+        bot.unavailable_chats.clear()
+        await main.resume_outbox_requests()
+
+    asyncio.run(run())
+
+    main_group_posts = get_main_group_posts(bot)
+    assert len(main_group_posts) == 1
+    message_id = bot.sent.index(main_group_posts[0]) + 1
+    already_exists = [message for message in bot.sent
+                      if message['text'].startswith(main.CONFIG['messages_templates']['request_already_exists'])]
+    assert [message['chat_id'] for message in already_exists] == [8]
+    assert already_exists[0]['text'].endswith('/' + str(message_id))
+    assert main.get_request_subscribers(message_id) == {7, 8}
+    assert not main.CONTEXT['outbox']
+    assert not main.RECENT_REQUESTS_PENDING
+
+
+def test_same_request_confirmed_during_resume_is_published_once(bot, start_bot_tasks):
+    add_users_with_same_request([7, 8])
+    bot.unavailable_chats.add(main.CONFIG['groups']['main']['id'])
+
+    async def run():
+        start_bot_tasks()
+        await confirm_request(7, 100)
+        bot.unavailable_chats.clear()
+        await asyncio.gather(main.resume_outbox_requests(), confirm_request(8, 200))
+
+    asyncio.run(run())
+
+    assert len(get_main_group_posts(bot)) == 1
+    already_exists = [message for message in bot.sent
+                      if message['text'].startswith(main.CONFIG['messages_templates']['request_already_exists'])]
+    assert [message['chat_id'] for message in already_exists] == [8]
+    assert main.REQUESTS_LOG.segments[-1].records == 1
+    assert not main.CONTEXT['outbox']
@@ -0,0 +1,102 @@
+import main
+
+
+def make_request(message_id: int) -> dict:
+    return {'date': '2024-03-01T10:%02d:00+03:00' % (message_id % 60), 'category': 'Пожар', 'house': 1,
+            'section': message_id % 5 + 1, 'user': 42}
+
+
+def crash(requests_log: main.RequestsLogWriter) -> None:
+    # file is closed by the process exit, index of the segment is never saved
+    requests_log.file.close()
+    requests_log.file = None
+
+
+def load_requests_log(directory) -> main.RequestsLogWriter:
+    requests_log = main.RequestsLogWriter(str(directory), 'batch', 50, False)
+    requests_log.load()
+    return requests_log
+
+
+def test_restart_after_crash_keeps_offsets(tmp_path):
+    requests_log = load_requests_log(tmp_path)
+    requests_log.write_records([(message_id, make_request(message_id)) for message_id in range(1000, 1010)])
+    crash(requests_log)
+
+    requests_log = load_requests_log(tmp_path)
+    segment = requests_log.segments[-1]
+    assert segment.indexed_size == (tmp_path / (segment.name + '.txt')).stat().st_size
+    assert segment.records == 10
+    requests_log.write_records([(message_id, make_request(message_id)) for message_id in range(1010, 1130)])
+    crash(requests_log)
+
+    requests_log = load_requests_log(tmp_path)
+    segment = requests_log.segments[-1]
+    assert segment.records == 130
+    assert main.read_requests_cache_source_size(segment.cache_path) == segment.indexed_size
+    for message_id in range(1000, 1130):
+        assert requests_log.find(message_id) == make_request(message_id)
+
+
+def test_restart_after_crash_during_write(tmp_path):
+    requests_log = load_requests_log(tmp_path)
+    requests_log.write_records([(message_id, make_request(message_id)) for message_id in range(1000, 1006)])
+    crash(requests_log)
+    segment_path = tmp_path / (requests_log.segments[-1].name + '.txt')
+    with open(segment_path, 'ab') as f:
+        f.write(main.format_requests_history_line(1006, make_request(1006))[:20])
+
+    requests_log = load_requests_log(tmp_path)
+    assert requests_log.segments[-1].indexed_size == segment_path.stat().st_size
+    requests_log.write_records([(message_id, make_request(message_id)) for message_id in range(1006, 1080)])
+    crash(requests_log)
+
+    requests_log = load_requests_log(tmp_path)
+    assert requests_log.segments[-1].records == 80
+    for message_id in range(1000, 1080):
+        assert requests_log.find(message_id) == make_request(message_id)
+
+
+def test_restart_after_clean_close(tmp_path):
+    requests_log = load_requests_log(tmp_path)
+    requests_log.write_records([(message_id, make_request(message_id)) for message_id in range(1000, 1100)])
+    requests_log.close()
+
+    requests_log = load_requests_log(tmp_path)
+    assert requests_log.segments[-1].records == 100
+    assert requests_log.find(1099) == make_request(1099)
+
+
+def test_restart_after_segment_was_replaced(tmp_path):
+    requests_log = load_requests_log(tmp_path)
+    requests_log.write_records([(message_id, make_request(message_id)) for message_id in range(1000, 1100)])
+    requests_log.close()
+    segment_path = tmp_path / (requests_log.segments[-1].name + '.txt')
+    segment_path.write_bytes(b''.join(main.format_requests_history_line(message_id, make_request(message_id))
+                                      for message_id in range(2000, 2010)))
+
+    requests_log = load_requests_log(tmp_path)
+    segment = requests_log.segments[-1]
+    assert segment.records == 10
+    assert segment.indexed_size == segment_path.stat().st_size
+    assert requests_log.find(1050) is None
+    assert requests_log.find(2005) == make_request(2005)
+
+
+def test_filtered_export_reads_posted_rows(tmp_path):
+    def make_filtered_request(message_id: int) -> dict:
+        return dict(make_request(message_id), house=message_id % 3 + 1,
+                    category='Пожар' if message_id % 2 else 'Протечка воды')
+
+    requests_log = load_requests_log(tmp_path)
+    requests_log.write_records([(message_id, make_filtered_request(message_id)) for message_id in range(1000, 1100)])
+    crash(requests_log)
+
+    requests_log = load_requests_log(tmp_path)
+    assert requests_log.plan_export(None, None, {'house': '7'}) == []
+    [(cache_path, rows)] = requests_log.plan_export(None, None, {'house': '2', 'category': 'воды'})
+    expected = [message_id for message_id in range(1000, 1100) if message_id % 3 == 1 and message_id % 2 == 0]
+    assert rows == [message_id - 1000 for message_id in expected]
+    requests = main.load_requests_cache_frame(cache_path, None, None, rows, 'Europe/Moscow')
+    assert requests.index.tolist() == expected
+    assert set(requests['category']) == {'Протечка воды'}
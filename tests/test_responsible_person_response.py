@@ -0,0 +1,48 @@
+import asyncio
+
+from telegram import Update
+
+import main
+
+RESPONSIBLE_PERSON_ID = 11111111
+
+
+def deliver_response(start_bot_tasks, users_ids: list) -> None:
+    chat_id = main.CONFIG['groups']['chat']['id']
+    update = Update.de_json({'update_id': 1,
+                             'message': {'message_id': 30, 'date': 0, 'text': 'Охрана выехала',
+                                         'chat': {'id': chat_id, 'type': 'supergroup'},
+                                         'from': {'id': RESPONSIBLE_PERSON_ID, 'is_bot': False, 'first_name': 'A'}}},
+                            None)
+
+    async def run():
+        start_bot_tasks()
+        await main.deliver_responsible_person_response(update, users_ids, 'response')
+
+    asyncio.run(run())
+
+
+def test_complete_delivery_is_not_reported(bot, start_bot_tasks):
+    deliver_response(start_bot_tasks, [1, 2])
+
+    assert sorted(message['chat_id'] for message in bot.sent) == [1, 2]
+
+
+def test_incomplete_delivery_is_reported_privately(bot, start_bot_tasks):
+    bot.blocked_chats.add(2)
+
+    deliver_response(start_bot_tasks, [1, 2])
+
+    report = bot.sent[-1]
+    assert report['chat_id'] == RESPONSIBLE_PERSON_ID
+    assert report['text'].startswith('Ответ доставлен: 1 из 2, бот заблокирован: 1, ошибки: 0')
+
+
+def test_report_goes_to_group_when_responsible_person_is_unreachable(bot, start_bot_tasks):
+    bot.blocked_chats.update([2, RESPONSIBLE_PERSON_ID])
+
+    deliver_response(start_bot_tasks, [1, 2])
+
+    report = bot.sent[-1]
+    assert report['chat_id'] == main.CONFIG['groups']['chat']['id']
+    assert report['reply_to_message_id'] == 30
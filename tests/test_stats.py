@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Update
+
+import main
+
+
+def add_requests(days: int, houses: int) -> None:
+    for day in range(1, days + 1):
+        for house in range(1, houses + 1):
+            main.add_requests_stats({'date': '2024-03-%02dT10:00:00+03:00' % day, 'category': 'Пожар',
+                                     'house': str(house), 'section': 1})
+
+
+def show_requests_stats(start_bot_tasks, args: list) -> None:
+    user_id = main.CONFIG['superusers'][0]
+    update = Update.de_json({'update_id': 1,
+                             'message': {'message_id': 1, 'date': 0, 'text': '/stats',
+                                         'chat': {'id': user_id, 'type': 'private'},
+                                         'from': {'id': user_id, 'is_bot': False, 'first_name': 'A'}}}, None)
+
+    async def run():
+        start_bot_tasks()
+        await main.show_requests_stats(update, SimpleNamespace(args=args))
+
+    asyncio.run(run())
+
+
+def test_stats_are_counted_for_days_range(bot, start_bot_tasks):
+    add_requests(10, 2)
+    main.build_requests_stats_index()
+
+    show_requests_stats(start_bot_tasks, ['2024-03-03', '2024-03-04', 'house=2'])
+
+    [message] = bot.sent
+    assert message['text'].startswith('Заявок с 2024-03-03 по 2024-03-04: 2\n')
+    assert '  2024-03-02: 1' not in message['text']
+
+
+def test_long_stats_are_split_into_messages(bot, start_bot_tasks):
+    add_requests(31, 400)
+
+    show_requests_stats(start_bot_tasks, ['2024-03-01', '2024-03-31'])
+
+    assert len(bot.sent) > 1
+    assert all(len(message['text']) <= main.MessageLimit.MAX_TEXT_LENGTH for message in bot.sent)
+    text = '\n'.join(message['text'] for message in bot.sent)
+    assert 'Заявок с 2024-03-01 по 2024-03-31: 12400' in text
+    assert '  400: 31' in text
+    assert '  2024-03-31: 400' in text
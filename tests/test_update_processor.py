@@ -0,0 +1,73 @@
+import asyncio
+import random
+
+from telegram import Update
+
+import main
+
+USERS_COUNT = 200
+UPDATES_COUNT = 10000
+MAX_CONCURRENT_UPDATES = 64
+
+
+def make_update(update_id: int, user_id: int, text: str = 'ok') -> Update:
+    return Update.de_json({'update_id': update_id,
+                           'message': {'message_id': update_id, 'date': 0, 'text': text,
+                                       'chat': {'id': user_id, 'type': 'private'},
+                                       'from': {'id': user_id, 'is_bot': False, 'first_name': 'A'}}}, None)
+
+
+def test_updates_are_ordered_per_user_under_load():
+    processed = {}
+    running = [0, 0]
+
+    async def handle(update: Update):
+        running[0] += 1
+        running[1] = max(running[1], running[0])
+        await asyncio.sleep(random.random() / 1000)
+        processed.setdefault(update.effective_user.id, []).append(update.update_id)
+        running[0] -= 1
+
+    async def run():
+        processor = main.UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES)
+        updates = [make_update(update_id, random.randrange(USERS_COUNT)) for update_id in range(UPDATES_COUNT)]
+        await asyncio.gather(*[processor.process_update(update, handle(update)) for update in updates])
+        return processor
+
+    processor = asyncio.run(run())
+
+    assert sum(len(updates_ids) for updates_ids in processed.values()) == UPDATES_COUNT
+    for updates_ids in processed.values():
+        assert updates_ids == sorted(updates_ids)
+    assert 1 < running[1] <= MAX_CONCURRENT_UPDATES
+    assert not processor.users_locks and not processor.users_pending_updates
+
+
+def test_same_request_confirmed_by_two_users_at_once_is_published_once(bot, start_bot_tasks):
+    users_ids = [7, 8]
+    for user_id in users_ids:
+        main.CONTEXT['users'][user_id] = {'bot_started': 1, 'dialog_state': 'confirm',
+                                          'selected_category': 'Пожарная сигнализация',
+                                          'selected_street': 'улица Пушкина', 'selected_house': '2',
+                                          'selected_section': 1}
+
+    async def run():
+        start_bot_tasks()
+        processor = main.UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES)
+        updates = [make_update(100 + user_id, user_id) for user_id in users_ids]
+        await asyncio.gather(*[processor.process_update(update, main.proceed_confirm_state(update, 'ok', 'confirm'))
+                               for update in updates])
+
+    asyncio.run(run())
+
+    main_group_posts = [message for message in bot.sent if message['chat_id'] == main.CONFIG['groups']['main']['id']]
+    assert len(main_group_posts) == 1
+    already_exists = [message for message in bot.sent
+                      if message['text'].startswith(main.CONFIG['messages_templates']['request_already_exists'])]
+    assert [message['chat_id'] for message in already_exists] == [8]
+    # main group post is the first message sent, both users are subscribed to responses to it
+    assert bot.sent[0] is main_group_posts[0]
+    assert main.get_request_subscribers(1) == {7, 8}
+    assert not main.RECENT_REQUESTS_PENDING
+    assert main.REQUESTS_LOG.segments[-1].records == 1
+    assert not main.CONTEXT['outbox']